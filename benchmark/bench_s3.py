@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Benchmark riproducibile degli script S3 contro uno stand-in S3 locale.
+
+Avvia un moto server (oppure usa --endpoint-url, es. MinIO), popola un bucket
+con chiavi sintetiche (numero, distribuzione delle dimensioni e forma dei
+prefissi configurabili) ed esegue, per ogni numero di worker richiesto:
+
+- count:    count_s3.py (--parallel N, 0 = listing sequenziale)
+- rename:   rename_segment.py (MAX_WORKERS=N) su un sotto-prefisso
+- upload / download: s3_manager.py --batch (--concurrency N)
+
+Ogni scenario gira in un processo separato: si misurano durata, throughput
+(chiavi/s, MB/s), richieste AWS per operazione (hook botocore sul client
+condiviso di common/aws_clients.py) e picco di RSS. I risultati vanno in un
+file JSON; --compare stampa il confronto con un'esecuzione precedente.
+
+Uso:
+    python bench_s3.py --keys 20000 --workers 0,4,16 --out results/base.json
+    python bench_s3.py --keys 20000 --workers 0,4,16 --compare results/base.json
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = {
+    "count": os.path.join(ROOT, "s3_count_by_prefix", "count_s3.py"),
+    "rename": os.path.join(ROOT, "s3_batch_rename", "rename_segment.py"),
+    "transfer": os.path.join(ROOT, "s3_manager", "s3_manager.py"),
+}
+BUCKET = "bench"
+SEED_PREFIX = "bench/"
+# Sotto-prefisso rinominato dallo scenario rename (lo stesso a ogni run)
+RENAME_SHARD = "000"
+SIZE_UNITS = {"b": 1, "k": 1024, "m": 1024 * 1024}
+
+
+def parse_sizes(spec):
+    """'1k:80,64k:19,1m:1' -> [(byte, peso), ...]"""
+    out = []
+    for part in spec.split(","):
+        size, weight = part.split(":")
+        unit = size[-1].lower()
+        value = float(size[:-1]) * SIZE_UNITS[unit] if unit in SIZE_UNITS else float(size)
+        out.append((int(value), float(weight)))
+    return out
+
+
+def peak_rss_mb():
+    """
+    Picco di RSS del processo corrente in MB. Su Linux si legge VmHWM, che
+    riparte da zero all'exec: ru_maxrss invece si porta dietro il picco del
+    processo che ha fatto fork (qui il benchmark con moto e i dati in RAM).
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def child_main(stats_path, script, script_args):
+    """
+    Processo figlio: registra un contatore di richieste su ogni client creato
+    da aws_clients, poi esegue lo script come __main__. I conteggi e il picco
+    di RSS vengono scritti in stats_path all'uscita (anche su sys.exit).
+    """
+    sys.path.insert(0, os.path.join(ROOT, "common"))
+    import aws_clients
+
+    requests = Counter()
+    hooked = set()
+    real_get_client = aws_clients.get_client
+
+    def count(event_name, **kwargs):
+        requests[event_name.rsplit(".", 1)[-1]] += 1
+
+    def get_client(*args, **kwargs):
+        client = real_get_client(*args, **kwargs)
+        if id(client) not in hooked:
+            hooked.add(id(client))
+            client.meta.events.register("before-send", count)
+        return client
+
+    aws_clients.get_client = get_client
+
+    def dump():
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump({"requests": dict(requests), "peak_rss_mb": peak_rss_mb()}, f)
+
+    atexit.register(dump)
+    sys.argv = [script] + script_args
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+
+
+def run_scenario(script, script_args, env, cwd):
+    """Esegue lo script in un processo figlio e restituisce (secondi, richieste, picco RSS MB, output)."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        stats_path = tmp.name
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", stats_path, script] + script_args
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.stdout.read().decode("utf-8", "replace")
+    proc.wait()
+    secs = time.perf_counter() - started
+    try:
+        with open(stats_path, encoding="utf-8") as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        stats = {}
+    finally:
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+    if proc.returncode not in (0, None):
+        print(output[-2000:])
+        raise RuntimeError(f"{os.path.basename(script)} terminato con codice {proc.returncode}")
+    return secs, stats.get("requests", {}), stats.get("peak_rss_mb", 0.0), output
+
+
+def start_moto(port):
+    from moto.server import ThreadedMotoServer
+
+    # Niente log per richiesta del server HTTP di moto
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def seed_bucket(s3, keys, sizes, fanout, depth, seed):
+    """Crea il bucket e carica keys oggetti sotto bench/<d1>/<d2>/...; restituisce {chiave: size}."""
+    s3.create_bucket(Bucket=BUCKET)
+    rnd = random.Random(seed)
+    values, weights = zip(*sizes)
+    layout = {}
+    for i in range(keys):
+        dirs = []
+        n = i
+        for _ in range(depth):
+            dirs.append(f"{n % fanout:03d}")
+            n //= fanout
+        layout[f"{SEED_PREFIX}{'/'.join(dirs)}/obj-{i:07d}.bin"] = rnd.choices(values, weights)[0]
+
+    def put(item):
+        key, size = item
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"\0" * size)
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(put, layout.items()))
+    return layout
+
+
+def make_local_files(directory, count, sizes, seed):
+    rnd = random.Random(seed + 1)
+    values, weights = zip(*sizes)
+    total = 0
+    for i in range(count):
+        size = rnd.choices(values, weights)[0]
+        with open(os.path.join(directory, f"file-{i:05d}.bin"), "wb") as f:
+            f.write(os.urandom(size))
+        total += size
+    return total
+
+
+def result(scenario, workers, secs, keys, size, requests, rss_mb):
+    return {
+        "scenario": scenario,
+        "workers": workers,
+        "secs": round(secs, 3),
+        "keys": keys,
+        "bytes": size,
+        "keys_per_sec": round(keys / secs, 1),
+        "mb_per_sec": round(size / (1024 * 1024) / secs, 2),
+        "requests": requests,
+        "requests_total": sum(requests.values()),
+        "peak_rss_mb": round(rss_mb, 1),
+    }
+
+
+def print_result(r, baseline=None):
+    line = (f"{r['scenario']:<9} workers={r['workers']:<3} {r['secs']:>8.2f}s "
+            f"{r['keys_per_sec']:>10.1f} keys/s {r['mb_per_sec']:>8.2f} MB/s "
+            f"{r['requests_total']:>7} req  RSS {r['peak_rss_mb']:.0f} MB")
+    if baseline:
+        delta = (baseline["secs"] - r["secs"]) / baseline["secs"] * 100 if baseline["secs"] else 0.0
+        line += f"  ({delta:+.1f}% vs base, base {baseline['secs']:.2f}s)"
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark degli script S3 contro uno stand-in S3 locale")
+    parser.add_argument("--keys", type=int, default=5000, help="Chiavi da creare nel bucket di test")
+    parser.add_argument("--sizes", default="1k:80,64k:19,1m:1",
+                        help="Distribuzione dimensioni dimensione:peso (moto tiene tutto in RAM)")
+    parser.add_argument("--fanout", type=int, default=10, help="Sotto-prefissi per livello")
+    parser.add_argument("--depth", type=int, default=2, help="Livelli di sotto-prefissi sotto bench/")
+    parser.add_argument("--workers", default="0,4,16", help="Numeri di worker da provare (0 = sequenziale dove esiste)")
+    parser.add_argument("--scenarios", default="count,rename,transfer", help="Scenari da eseguire")
+    parser.add_argument("--transfer-files", type=int, default=200, help="File locali per upload/download")
+    parser.add_argument("--seed", type=int, default=42, help="Seed per dimensioni e layout riproducibili")
+    parser.add_argument("--endpoint-url", default="", help="Endpoint S3 esistente (default: moto server locale)")
+    parser.add_argument("--port", type=int, default=5055, help="Porta del moto server")
+    parser.add_argument("--out", default="", help="File JSON dei risultati (default: results/bench-<timestamp>.json)")
+    parser.add_argument("--compare", default="", help="JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    workers = [int(w) for w in args.workers.split(",")]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {(r["scenario"], r["workers"]): r for r in json.load(f)["results"]}
+
+    server = None
+    endpoint = args.endpoint_url
+    if not endpoint:
+        server, endpoint = start_moto(args.port)
+    env = dict(os.environ,
+               AWS_ENDPOINT_URL=endpoint,
+               AWS_ACCESS_KEY_ID=os.getenv("AWS_ACCESS_KEY_ID", "bench"),
+               AWS_SECRET_ACCESS_KEY=os.getenv("AWS_SECRET_ACCESS_KEY", "bench"),
+               AWS_DEFAULT_REGION="us-east-1",
+               PYTHONUNBUFFERED="1")
+    os.environ.update({k: env[k] for k in ("AWS_ENDPOINT_URL", "AWS_ACCESS_KEY_ID",
+                                           "AWS_SECRET_ACCESS_KEY", "AWS_DEFAULT_REGION")})
+    workdir = tempfile.mkdtemp(prefix="bench-s3-")
+    results = []
+
+    try:
+        import boto3
+
+        s3 = boto3.client("s3")
+        started = time.perf_counter()
+        layout = seed_bucket(s3, args.keys, sizes, args.fanout, args.depth, args.seed)
+        total_bytes = sum(layout.values())
+        print(f"🪣 Seed: {len(layout)} chiavi, {total_bytes / (1024 * 1024):.1f} MB "
+              f"in {time.perf_counter() - started:.1f}s su {endpoint}", flush=True)
+
+        for w in workers:
+            if "count" in scenarios:
+                secs, req, rss, _ = run_scenario(
+                    SCRIPTS["count"], ["--bucket", BUCKET, "--prefix", SEED_PREFIX, "--parallel", str(w)], env, workdir)
+                results.append(result("count", w, secs, len(layout), 0, req, rss))
+                print_result(results[-1], baseline.get(("count", w)))
+
+            if "rename" in scenarios:
+                # Ogni run rinomina lo stesso sotto-prefisso, riportato poi com'era
+                # (rinomina inversa non misurata): i worker si confrontano sugli stessi dati
+                moved = {k: v for k, v in layout.items() if k.split("/")[1] == RENAME_SHARD}
+                rename_env = dict(env, BUCKET=BUCKET, SEARCH_PREFIX=f"{SEED_PREFIX}{RENAME_SHARD}/",
+                                  DRY_RUN="false")
+                secs, req, rss, _ = run_scenario(
+                    SCRIPTS["rename"], [],
+                    dict(rename_env, OLD_SEGMENT="/obj-", NEW_SEGMENT="/ren-", MAX_WORKERS=str(max(1, w))), workdir)
+                results.append(result("rename", w, secs, len(moved), sum(moved.values()), req, rss))
+                print_result(results[-1], baseline.get(("rename", w)))
+                run_scenario(SCRIPTS["rename"], [],
+                             dict(rename_env, OLD_SEGMENT="/ren-", NEW_SEGMENT="/obj-", MAX_WORKERS="16"), workdir)
+                restored = set()
+                for page in s3.get_paginator("list_objects_v2").paginate(
+                        Bucket=BUCKET, Prefix=f"{SEED_PREFIX}{RENAME_SHARD}/"):
+                    restored.update(o["Key"] for o in page.get("Contents", []))
+                if restored != set(moved):
+                    raise RuntimeError(f"ripristino di {SEED_PREFIX}{RENAME_SHARD}/ incompleto: "
+                                       f"{len(restored & set(moved))}/{len(moved)} chiavi")
+
+            if "transfer" in scenarios:
+                local = os.path.join(workdir, f"up-{w}")
+                os.makedirs(local)
+                size = make_local_files(local, args.transfer_files, sizes, args.seed)
+                names = sorted(os.listdir(local))
+                for scenario in ("upload", "download"):
+                    ops_path = os.path.join(workdir, f"{scenario}-{w}.jsonl")
+                    with open(ops_path, "w", encoding="utf-8") as f:
+                        for name in names:
+                            key = f"transfer/w{w}/{name}"
+                            op = ({"op": "upload", "src": os.path.join(local, name), "key": key}
+                                  if scenario == "upload" else
+                                  {"op": "download", "key": key, "dest": os.path.join(workdir, f"down-{w}", name)})
+                            f.write(json.dumps(dict(op, bucket=BUCKET)) + "\n")
+                    secs, req, rss, _ = run_scenario(
+                        SCRIPTS["transfer"],
+                        ["--batch", ops_path, "--report", ops_path + ".report", "--concurrency", str(max(1, w))],
+                        env, workdir)
+                    results.append(result(scenario, w, secs, len(names), size, req, rss))
+                    print_result(results[-1], baseline.get((scenario, w)))
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                   f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "endpoint": "moto" if server else endpoint,
+        "keys": args.keys, "sizes": args.sizes, "fanout": args.fanout, "depth": args.depth,
+        "transfer_files": args.transfer_files, "seed": args.seed,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"💾 Risultati: {out}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == "--child":
+        child_main(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark della classificazione eventi del tailer (nessuna chiamata AWS).
+
+Confronta la vecchia logica (json.loads su ogni riga, catena if/elif su
+log_stream.lower(), re.search non compilata, una print per riga) con la
+pipeline attuale (matcher unico compilato, cache per stream, json.loads solo
+su righe '{', una write per pagina da 1000 eventi).
+L'output va su /dev/null: si misura solo la CPU del client.
+
+Uso: python bench_labels.py [--events 200000] [--streams 300]
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import time
+
+bench_parser = argparse.ArgumentParser()
+bench_parser.add_argument('--events', type=int, default=200000)
+bench_parser.add_argument('--streams', type=int, default=300)
+bench_args = bench_parser.parse_args()
+
+# Il tailer legge argomenti e crea il client all'import: nessun argomento, regione fittizia
+sys.argv = [sys.argv[0]]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-south-1')
+# devnull resta aperto: il sink text del tailer scrive sullo stdout visto all'import
+devnull = open(os.devnull, 'w')
+with contextlib.redirect_stdout(devnull):
+    import tail_watch_cw_log as tailer
+
+PAGE_SIZE = 1000
+
+SERVICES = ["infocamere", "crm", "cdp", "utility", "google", "cammini", "ristoranti",
+            "datalake", "aem", "esperienze", "tools", "kube-proxy", "aws-load-balancer-controller", "other"]
+
+
+def legacy_print_event(event, severity_filter=""):
+    log_stream = event.get('logStreamName', 'unknown')
+    msg = event['message'].strip()
+    try:
+        parsed = json.loads(msg)
+        log_line = str(parsed.get('log', msg))
+    except json.JSONDecodeError:
+        log_line = msg
+    if severity_filter and severity_filter not in log_line.upper():
+        return
+    label = "INIT"
+    for name in SERVICES[:-1]:
+        if name in log_stream.lower():
+            label = name
+            break
+    else:
+        label = "___" + log_stream
+    re.search(r'\] *ERROR\b', log_line, re.IGNORECASE)
+    if tailer.error_pattern.search(log_line):
+        label = f"❌❌❌ ERROR -  {label}"
+    elif tailer.warn_pattern.search(log_line):
+        label = f"⚠️⚠️⚠️ WARN - {label}"
+    for line in log_line.splitlines():
+        if tailer.date_pattern.match(line):
+            print(f"{label} {line}", flush=True)
+        else:
+            print(f"│   {line}", flush=True)
+
+
+def make_events(count, streams):
+    rnd = random.Random(42)
+    names = [f"fluentbit-kube.var.log.containers.{rnd.choice(SERVICES)}-{i:04d}_ns_app-{i}.log"
+             for i in range(streams)]
+    events = []
+    for i in range(count):
+        level = rnd.choice(["INFO", "INFO", "INFO", "WARN", "ERROR"])
+        line = f"2025-01-01 10:00:00.000 [main] {level} com.example.Service - richiesta {i} completata"
+        if i % 2:
+            line = json.dumps({"log": line, "stream": "stdout"})
+        events.append({"timestamp": i, "logStreamName": rnd.choice(names), "message": line})
+    return events
+
+
+def legacy_run(events):
+    for event in events:
+        legacy_print_event(event)
+
+
+def pipeline_run(events):
+    for i in range(0, len(events), PAGE_SIZE):
+        tailer.render_events(events[i:i + PAGE_SIZE])
+
+
+def run(label, func, events):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(devnull):
+        func(events)
+    secs = time.perf_counter() - started
+    print(f"{label:<10} {len(events) / secs:>12,.0f} eventi/s")
+    return secs
+
+
+if __name__ == "__main__":
+    events = make_events(bench_args.events, bench_args.streams)
+    print(f"📊 {len(events)} eventi, {bench_args.streams} stream")
+    before = run("prima", legacy_run, events)
+    after = run("dopo", pipeline_run, events)
+    print(f"⚡ speedup x{before / after:.2f}")
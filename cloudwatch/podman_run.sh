@@ -95,7 +95,8 @@ IMAGE_NAME="cloudwatch-tail"
 # 4. Costruzione immagine
 # ---------------------------------------------------
 info "Inizio build dell'immagine '$IMAGE_NAME'..."
-if ! podman build -t "$IMAGE_NAME" .; then
+# Contesto = radice del repo, per includere common/aws_clients.py
+if ! podman build -t "$IMAGE_NAME" -f Dockerfile ..; then
   error_exit "build fallita. Controlla il Dockerfile e i permessi nella directory corrente."
 fi
 info "Build completata con successo."
@@ -107,9 +108,13 @@ if [ $# -eq 0 ]; then
   info "Nessun argomento passato al container."
 fi
 
+# Cartella di lavoro persistente (archivio locale, file di output)
+mkdir -p work
+
 info "Avvio del container '$IMAGE_NAME'..."
 if ! podman run --rm -it \
     --env-file "$TARGET_FILE" \
+    -v "$PWD/work:/app/work:Z" \
     "$IMAGE_NAME" "$@"; then
   error_exit "avvio del container fallito. 
 - Verifica i parametri passati: $* 
@@ -1,9 +1,16 @@
 import json
 import os
 import time
-import boto3
 import argparse
 import datetime
+import functools
+import gzip
+import heapq
+import signal
+import threading
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from botocore.exceptions import BotoCoreError, ClientError
 import re
@@ -13,6 +20,11 @@ import pytz
 import sys
 sys.stdout.reconfigure(line_buffering=True)
 
+# Factory client condivisa (common/aws_clients.py; nel container è copiata accanto allo script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import aws_clients
+import aws_metrics
+
 # Regex per matchare "ERROR" come parola (non cattura "errorCode"), preceduto da ']' e spazi opzionali
 error_pattern = re.compile(r'\] *ERROR\b', re.IGNORECASE)
 # Regex per matchare "WARN" come parola
@@ -21,6 +33,29 @@ warn_pattern  = re.compile(r'\] *WARN\b',  re.IGNORECASE)
 date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}')
 
 TIMEOUT_SECS=10
+# Polling adattivo: si scende a POLL_MIN_SECS quando arrivano log, si risale fino a TIMEOUT_SECS quando è fermo
+POLL_MIN_SECS = 1
+# eventId già stampati (ultimi N) per non duplicare gli eventi con lo stesso timestamp
+SEEN_EVENTS_MAX = 10000
+# --out-file: flush del gzip al massimo ogni N secondi (un flush per batch peggiora la compressione)
+OUT_FILE_FLUSH_SECS = 5
+# Label per stream: risultati memorizzati per logStreamName (ultimi N stream)
+STREAM_LABEL_CACHE = 4096
+# Backfill: durata minima di una fetta temporale
+BACKFILL_MIN_SLICE_MS = 60 * 1000
+# Archivio locale: un segmento del tail live ogni 10 minuti; l'ultimo minuto
+# prima del download non è considerato completo (eventi ancora in ingestione):
+# i range del tail scaricati prima di essere assestati restano provvisori
+ARCHIVE_SEGMENT_MS = 10 * 60 * 1000
+ARCHIVE_SETTLE_MS = 60 * 1000
+# Modalità --summary: contatori a bucket da 10s per le finestre 1m/5m/15m
+SUMMARY_BUCKET_MS = 10 * 1000
+SUMMARY_SLOTS = 90
+SUMMARY_WINDOWS = (('1m', 60), ('5m', 300), ('15m', 900))
+# Spike: almeno N eventi nell'ultimo minuto e oltre FACTOR volte la media/minuto dei 14 precedenti
+SPIKE_MIN_EVENTS = 5
+SPIKE_FACTOR = 3
+SPIKE_MIN_HISTORY_MS = 5 * 60 * 1000
 # Carica variabili .env
 load_dotenv()
 
@@ -29,9 +64,44 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--filter', default='', help="Filtro log stream name")
 parser.add_argument('--since', default='5m', help="Quanto indietro nei log (es: 30m, 1h, 2h)")
 parser.add_argument('--severity', default='', help="Filtra solo log che contengono questa stringa (es: ERROR, WARN, INFO)")
+parser.add_argument('--labels', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'labels.json'),
+                    help="File JSON con le regole label per stream: [{\"pattern\": regex, \"label\": testo}, ...] (vince la prima)")
+parser.add_argument('--format', choices=['text', 'jsonl', 'none'], default='text',
+                    help="Formato su stdout: text (console), jsonl (campi parsati, per pipe), none")
+parser.add_argument('--out-file', default='',
+                    help="File di output aggiuntivo compresso gzip e ruotato (es: work/tail.jsonl.gz)")
+parser.add_argument('--out-format', choices=['text', 'jsonl'], default='jsonl', help="Formato di --out-file")
+parser.add_argument('--rotate-mb', type=int, default=100, help="Rotazione di --out-file ogni N MB non compressi")
+parser.add_argument('--rotate-keep', type=int, default=5, help="File ruotati da conservare")
+parser.add_argument('--summary', action='store_true',
+                    help="Invece delle righe mostra una tabella periodica di eventi per label/severità (1m/5m/15m) con spike")
+parser.add_argument('--summary-every', type=int, default=10, help="Secondi tra un aggiornamento e l'altro della tabella --summary")
+parser.add_argument('--archive-dir', default='',
+                    help="Archivio locale compresso degli eventi (es: work/archive): i range già scaricati vengono letti da disco")
+parser.add_argument('--archive-keep-days', type=float, default=30,
+                    help="Segmenti dell'archivio più vecchi di N giorni rimossi all'avvio (0 = conserva tutto)")
+parser.add_argument('--backfill-workers', type=int, default=4,
+                    help="Richieste parallele per recuperare la finestra --since prima del tail (1 = sequenziale)")
+parser.add_argument('--backfill-slices', type=int, default=0,
+                    help="Numero di fette temporali del backfill (default: 4 x workers, minimo 1 minuto per fetta)")
+parser.add_argument('--backfill-streams', default='',
+                    help="Prefissi di stream separati da virgola (dopo il filtro): il backfill divide anche per stream")
+parser.add_argument('--metrics-interval', type=float, default=0,
+                    help="Secondi tra due righe di avanzamento con le metriche delle API (0 = nessuna)")
+parser.add_argument('--metrics-out', default='',
+                    help="Snapshot finale delle metriche: JSON o testo Prometheus (in base all'estensione)")
 
 args = parser.parse_args()
 
+# Prima di creare i client: aws_clients li strumenta solo se la raccolta è attiva
+metrics = aws_metrics.enable() if args.metrics_interval > 0 or args.metrics_out else None
+
+# Le righe di log vanno su RENDER_OUT; con --format jsonl i messaggi di stato
+# passano su stderr così stdout resta JSONL pulito per il pipe
+RENDER_OUT = sys.stdout
+if args.format == 'jsonl':
+    sys.stdout = sys.stderr
+
 print("📦 Argomenti ricevuti:", args)
 
 
@@ -39,6 +109,32 @@ print("📦 Argomenti ricevuti:", args)
 LOG_STREAM_FILTER = f"fluentbit-kube.var.log.containers.{args.filter}"
 SINCE = args.since
 
+def load_label_rules(path):
+    """
+    Compila le regole del file label in un'unica regex: ogni regola è un ramo
+    con lookahead, provati nell'ordine del file, quindi vince la prima regola
+    che compare nel nome dello stream (come la vecchia catena if/elif).
+    """
+    with open(path, encoding='utf-8') as f:
+        rules = json.load(f)
+    if not rules:
+        return None, []
+    branches = '|'.join(f"(?=.*?(?:{rule['pattern']}))(?P<r{i}>)" for i, rule in enumerate(rules))
+    return re.compile(f"^(?:{branches})", re.IGNORECASE | re.DOTALL), [rule['label'] for rule in rules]
+
+try:
+    LABEL_MATCHER, LABELS = load_label_rules(args.labels)
+except (OSError, ValueError, KeyError, re.error) as e:
+    print(f"❌ Errore nel file label '{args.labels}': {e}")
+    sys.exit(1)
+
+@functools.lru_cache(maxsize=STREAM_LABEL_CACHE)
+def stream_label(log_stream):
+    match = LABEL_MATCHER.match(log_stream) if LABEL_MATCHER else None
+    if match:
+        return LABELS[int(match.lastgroup[1:])]
+    return "___" + log_stream
+
 # Parse durata tipo "30m", "1h"
 def parse_duration(dur):
     unit = dur[-1]
@@ -70,7 +166,8 @@ print("🌍 AWS_DEFAULT_REGION:", os.getenv('AWS_DEFAULT_REGION'))
 print(f"🎯 Filtro stream: '{LOG_STREAM_FILTER}', da {SINCE} fa")
 print("-"*50)
 
-client = boto3.client('logs')
+# Pool connessioni dimensionato sul backfill parallelo; retry adaptive per il throttling di FilterLogEvents
+client = aws_clients.lazy_client('logs', max_workers=args.backfill_workers)
 LOG_GROUP=os.getenv('LOG_GROUP')
 
 print("🔐 LOG_GROUP:", LOG_GROUP)
@@ -100,136 +197,651 @@ def get_first_stream_with_events():
     print("⚠️ Nessun log stream trovato.")
     return None
 
+def format_event(event, severity_filter=""):
+    """
+    Classifica un evento di filter_log_events: restituisce
+    (evento, label, severità, riga di log) oppure None se scartato dal filtro.
+    """
+    log_stream = event.get('logStreamName', 'unknown')
+
+    msg = event['message'].strip()
+
+    # Prova a parsare JSON per estrarre 'log' (solo se la riga può essere un oggetto JSON)
+    log_line = msg
+    if msg.startswith('{'):
+        try:
+            parsed = json.loads(msg)
+            if isinstance(parsed, dict):
+                log_line = str(parsed.get('log', msg))  # forza in stringa
+        except json.JSONDecodeError:
+            pass
+
+    # Filtro manuale se filterPattern non trova tutto
+    if severity_filter and severity_filter not in log_line.upper():
+        return None
+
+    # Se singolo filtro stream non uso la logica delle label
+    if args.filter:
+        label = "❌❌❌ ERROR" if error_pattern.search(log_line) else ""
+    else:
+        label = stream_label(log_stream)
+
+    if error_pattern.search(log_line):
+        severity = "ERROR"
+    elif warn_pattern.search(log_line):
+        severity = "WARN"
+    else:
+        severity = ""
+    return event, label, severity, log_line
+
+def render_text(items):
+    """Righe console: label sulle nuove entry (riga con data), indentazione sulle continuazioni."""
+    out = []
+    for _, label, severity, log_line in items:
+        # Sovrascrive la label se c'è un errore o un warning
+        if severity == "ERROR":
+            label = f"❌❌❌ ERROR -  {label}"
+        elif severity == "WARN":
+            label = f"⚠️⚠️⚠️ WARN - {label}"
+        for line in log_line.splitlines():
+            if date_pattern.match(line):
+                out.append(f"{label} {line}\n")
+            else:
+                out.append(f"│   {line}\n")
+    return "".join(out)
+
+def render_jsonl(items):
+    """Un oggetto JSON per evento con i campi già parsati."""
+    return "".join(
+        json.dumps({
+            'timestamp': event['timestamp'],
+            'stream': event.get('logStreamName', 'unknown'),
+            'label': label,
+            'severity': severity,
+            'log': log_line,
+        }, ensure_ascii=False) + "\n"
+        for event, label, severity, log_line in items
+    )
+
+RENDERERS = {'text': render_text, 'jsonl': render_jsonl}
+
+class StreamSink:
+    """Scrive ogni batch con una sola write + flush (stdout o file già aperto)."""
+
+    def __init__(self, out, fmt):
+        self.out = out
+        self.render = RENDERERS[fmt]
+
+    def write(self, items):
+        data = self.render(items)
+        if data:
+            self.out.write(data)
+            self.out.flush()
+
+    def close(self):
+        pass
+
+class RotatingGzipSink:
+    """
+    File gzip ruotato ogni max_bytes non compressi (byte UTF-8, non caratteri):
+    path -> path.1 -> ... -> path.<keep>. Un file già presente viene ripreso in
+    append contando i byte che contiene; il gzip viene svuotato su disco ogni
+    flush_secs da un thread e alla rotazione, non a ogni batch.
+    """
+
+    def __init__(self, path, fmt, max_bytes, keep, flush_secs=OUT_FILE_FLUSH_SECS):
+        self.path = path
+        self.render = RENDERERS[fmt]
+        self.max_bytes = max_bytes
+        self.keep = keep
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.size = self.existing_size(path)
+        self.file = None
+        if self.size is None:
+            # troncato da un crash: un nuovo membro gzip in coda non sarebbe leggibile
+            self.rotate()
+        else:
+            self.file = gzip.open(path, 'ab')
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.flusher, args=(flush_secs,), daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def existing_size(path):
+        """Byte non compressi già nel file (0 se non esiste), None se il gzip è troncato o illeggibile."""
+        if not os.path.exists(path):
+            return 0
+        size = 0
+        try:
+            with gzip.open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    size += len(block)
+        except (EOFError, OSError, zlib.error):
+            return None
+        return size
+
+    def rotate(self):
+        if self.file:
+            self.file.close()
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.keep > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = gzip.open(self.path, 'wb')
+        self.size = 0
+
+    def write(self, items):
+        data = self.render(items)
+        if not data:
+            return
+        data = data.encode('utf-8')
+        with self.lock:
+            self.file.write(data)
+            self.dirty = True
+            self.size += len(data)
+            if self.size >= self.max_bytes:
+                self.rotate()
+                self.dirty = False
+
+    def flusher(self, every):
+        while not self.stop.wait(every):
+            with self.lock:
+                if self.dirty:
+                    self.file.flush()
+                    self.dirty = False
+
+    def close(self):
+        self.stop.set()
+        with self.lock:
+            self.file.close()
+
+class RateSummary:
+    """
+    Sink della modalità --summary: conta gli eventi per (label, severità) in
+    SUMMARY_SLOTS bucket circolari da SUMMARY_BUCKET_MS (memoria fissa per
+    chiave, nessun evento conservato) e ristampa la tabella ogni `every` secondi.
+    """
+
+    def __init__(self, out, every):
+        self.out = out
+        self.buckets = {}  # chiave -> (id bucket, conteggi)
+        self.first_ts = None
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.refresh, args=(every,), daemon=True)
+        self.thread.start()
+
+    def write(self, items):
+        oldest = int(time.time() * 1000) // SUMMARY_BUCKET_MS - SUMMARY_SLOTS
+        with self.lock:
+            for event, _, severity, _ in items:
+                b = event['timestamp'] // SUMMARY_BUCKET_MS
+                if b <= oldest:
+                    continue
+                if self.first_ts is None or event['timestamp'] < self.first_ts:
+                    self.first_ts = event['timestamp']
+                key = (stream_label(event.get('logStreamName', 'unknown')), severity or 'INFO')
+                ids, counts = self.buckets.setdefault(key, ([0] * SUMMARY_SLOTS, [0] * SUMMARY_SLOTS))
+                i = b % SUMMARY_SLOTS
+                if ids[i] != b:
+                    ids[i] = b
+                    counts[i] = 0
+                counts[i] += 1
+
+    def windows(self, ids, counts, now_bucket):
+        return [sum(c for bid, c in zip(ids, counts) if bid > now_bucket - secs * 1000 // SUMMARY_BUCKET_MS)
+                for _, secs in SUMMARY_WINDOWS]
+
+    def table(self):
+        now_ms = int(time.time() * 1000)
+        now_bucket = now_ms // SUMMARY_BUCKET_MS
+        with self.lock:
+            rows = []
+            for key, (ids, counts) in list(self.buckets.items()):
+                totals = self.windows(ids, counts, now_bucket)
+                if not totals[-1]:
+                    del self.buckets[key]  # nessun evento negli ultimi 15 minuti
+                    continue
+                rows.append((key, totals))
+            history = self.first_ts is not None and now_ms - self.first_ts >= SPIKE_MIN_HISTORY_MS
+
+        rows.sort(key=lambda row: (row[0][1] != 'ERROR', row[0][1] != 'WARN', -row[1][0], row[0][0]))
+        lines = [f"\n📊 {datetime.datetime.now().strftime('%H:%M:%S')}  eventi per label/severità"
+                 + ("" if history else " (baseline spike in costruzione)"),
+                 f"{'label':<32} {'sev':<6} {'1m':>7} {'5m':>7} {'15m':>7}"]
+        for (label, severity), (c1, c5, c15) in rows:
+            baseline = (c15 - c1) / 14
+            spike = history and c1 >= SPIKE_MIN_EVENTS and c1 > SPIKE_FACTOR * baseline
+            lines.append(f"{label[:32]:<32} {severity:<6} {c1:>7} {c5:>7} {c15:>7}"
+                         + (f"  🚨 spike (media {baseline:.1f}/min)" if spike else ""))
+        if not rows:
+            lines.append("⏳ Nessun evento negli ultimi 15 minuti")
+        return "\n".join(lines) + "\n"
+
+    def refresh(self, every):
+        while not self.stop.wait(every):
+            self.out.write(self.table())
+            self.out.flush()
+
+    def close(self):
+        self.stop.set()
+        self.out.write(self.table())
+        self.out.flush()
+
+def build_sinks():
+    sinks = []
+    if args.summary:
+        sinks.append(RateSummary(RENDER_OUT, args.summary_every))
+    elif args.format != 'none':
+        sinks.append(StreamSink(RENDER_OUT, args.format))
+    if args.out_file:
+        sinks.append(RotatingGzipSink(args.out_file, args.out_format, args.rotate_mb * 1024 * 1024, args.rotate_keep))
+    return sinks
+
+SINKS = build_sinks()
+
+def render_events(events, severity_filter=""):
+    """
+    Formatta un'intera pagina/fetta di eventi e la scrive su ogni sink con una
+    sola write per batch. Restituisce il numero di eventi scritti.
+    """
+    with aws_metrics.phase("render"):
+        items = [item for item in (format_event(e, severity_filter) for e in events) if item]
+        if items:
+            for sink in SINKS:
+                sink.write(items)
+    return len(items)
+
+def filter_kwargs(log_group, start_time, severity_filter, stream_prefix=None):
+    kwargs = {
+        'logGroupName': log_group,
+        'startTime': start_time,
+        'interleaved': True,
+    }
+    if stream_prefix:
+        kwargs['logStreamNamePrefix'] = stream_prefix
+    elif args.filter:
+        kwargs['logStreamNamePrefix'] = LOG_STREAM_FILTER
+    if severity_filter:
+        kwargs['filterPattern'] = f'"{severity_filter}"'
+    return kwargs
+
+def fetch_slice(log_group, start_ms, end_ms, severity_filter, stream_prefix=None):
+    """
+    Tutti gli eventi in [start_ms, end_ms) (tutte le pagine), ordinati per timestamp.
+    """
+    kwargs = filter_kwargs(log_group, start_ms, severity_filter, stream_prefix)
+    kwargs['endTime'] = end_ms - 1  # endTime è inclusivo
+    events = []
+    with aws_metrics.phase("backfill"):
+        while True:
+            response = client.filter_log_events(**kwargs)
+            events.extend(response.get('events', []))
+            token = response.get('nextToken')
+            if not token:
+                break
+            kwargs['nextToken'] = token
+    events.sort(key=lambda e: e['timestamp'])
+    return events
+
+def backfill(log_group, start_time, severity_filter=""):
+    """
+    Recupera [start_time, adesso) dividendo la finestra in fette temporali
+    (e opzionalmente per prefisso di stream) scaricate in parallelo; le fette
+    vengono stampate in ordine di timestamp. Con --archive-dir i range già
+    archiviati vengono letti da disco e solo quelli mancanti scaricati (e
+    archiviati). Restituisce il timestamp da cui far partire il tail, senza
+    buchi né duplicati.
+    """
+    cut = int(time.time() * 1000)
+    workers = max(1, args.backfill_workers)
+    n_slices = args.backfill_slices or workers * 4
+    n_slices = max(1, min(n_slices, (cut - start_time) // BACKFILL_MIN_SLICE_MS))
+    step = -(-(cut - start_time) // n_slices)
+
+    streams = [p.strip() for p in args.backfill_streams.split(',') if p.strip()]
+    prefixes = [LOG_STREAM_FILTER + p for p in streams] or [None]
+    prefix, pattern = archive_filters(severity_filter)
+
+    plan = ARCHIVE.plan(start_time, cut, prefix, pattern) if ARCHIVE else [(start_time, cut, None)]
+    slices = []
+    for a, b, seg in plan:
+        if seg:
+            slices.append((a, b, seg))
+        else:
+            slices.extend((t, min(t + step, b), None) for t in range(a, b, step))
+
+    def submit(pool, sl):
+        a, b, seg = sl
+        if seg:
+            return [pool.submit(ARCHIVE.read, seg, a, b, prefix)]
+        return [pool.submit(fetch_slice, log_group, a, b, severity_filter, p) for p in prefixes]
+
+    archived = sum(1 for sl in slices if sl[2])
+    print(f"⏪ Backfill di {len(slices)} fette x {len(prefixes)} stream con {workers} worker"
+          + (f" ({archived} dall'archivio locale)" if ARCHIVE else "") + "...")
+    started = time.time()
+    total = 0
+    stored = False
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            todo = iter(slices)
+            # Al massimo 2 x workers fette in memoria: si stampa sempre la più vecchia
+            for _ in range(workers * 2):
+                sl = next(todo, None)
+                if sl is None:
+                    break
+                pending.append((sl, submit(pool, sl)))
+            while pending:
+                (a, b, seg), futures = pending.popleft()
+                parts = [f.result() for f in futures]
+                sl = next(todo, None)
+                if sl is not None:
+                    pending.append((sl, submit(pool, sl)))
+                merged = list(heapq.merge(*parts, key=lambda e: e['timestamp']))
+                # Le fette per prefisso di stream non coprono tutti gli stream: non si archiviano
+                if ARCHIVE and not seg and not streams:
+                    ARCHIVE.store(a, b, merged, prefix, pattern, save_index=False)
+                    stored = True
+                render_events(merged, severity_filter)
+                total += len(merged)
+    finally:
+        # indice scritto una volta per backfill (anche se interrotto: i segmenti salvati restano validi)
+        if stored:
+            ARCHIVE.save_index()
+    print(f"✅ Backfill completato: {total} eventi in {time.time() - started:.1f}s, passo al tail live")
+    return cut
+
+class LogArchive:
+    """
+    Archivio locale per log group: segmenti JSONL gzip, ciascuno con il range
+    [start, end) scaricato per intero, più un indice (index.json) con range,
+    filtri della richiesta (prefisso stream, filterPattern) e stream presenti.
+    Un segmento serve una richiesta se è stato scaricato con un filtro uguale
+    o più ampio; gli eventi vengono poi filtrati in locale. I segmenti
+    'provisional' (tail live scaricato prima che il range fosse assestato,
+    può mancare di eventi ingeriti in ritardo) non servono richieste: plan()
+    li riscarica e compact() li rimuove quando un segmento completo li copre.
+    All'apertura i segmenti oltre keep_ms vengono rimossi e l'indice compattato,
+    così plan() non rallenta con l'accumularsi dei segmenti.
+    """
+
+    def __init__(self, root, log_group, keep_ms=0):
+        self.dir = os.path.join(root, re.sub(r'[^A-Za-z0-9._-]+', '_', log_group.strip('/')))
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, 'index.json')
+        self.segments = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.segments = json.load(f)
+        self.tail_from = None
+        self.tail_events = []
+        # fin dove il tail live ha scaricato range già assestati (vedi tail_polled)
+        self.tail_settled = None
+        if self.compact(keep_ms):
+            self.save_index()
+
+    def compact(self, keep_ms):
+        """
+        Rimuove i segmenti finiti prima di adesso - keep_ms (keep_ms 0 = nessun limite),
+        quelli contenuti in un segmento con gli stessi filtri (se vuoti o se il
+        contenitore ha eventi) e fonde i segmenti vuoti contigui.
+        Restituisce True se l'indice è cambiato.
+        """
+        cutoff = int(time.time() * 1000) - keep_ms if keep_ms else None
+        kept = []
+        provisional = []
+        # fine più lontana tra i segmenti tenuti con gli stessi filtri (tutti / con eventi)
+        reach = reach_file = None
+        for seg in sorted(self.segments, key=lambda seg: (seg['prefix'] or '', seg['pattern'] or '',
+                                                           seg['start'], -seg['end'])):
+            if seg.get('provisional'):
+                provisional.append(seg)
+                continue
+            prev = kept[-1] if kept else None
+            if prev is None or (prev['prefix'], prev['pattern']) != (seg['prefix'], seg['pattern']):
+                prev = reach = reach_file = None
+            covered = reach_file if seg['file'] else reach
+            if cutoff is not None and seg['end'] <= cutoff or covered is not None and seg['end'] <= covered:
+                if seg['file'] and os.path.exists(os.path.join(self.dir, seg['file'])):
+                    os.remove(os.path.join(self.dir, seg['file']))
+                continue
+            reach = seg['end'] if reach is None else max(reach, seg['end'])
+            if seg['file']:
+                reach_file = seg['end'] if reach_file is None else max(reach_file, seg['end'])
+            if prev and not seg['file'] and not prev['file'] and seg['start'] == prev['end']:
+                prev['end'] = seg['end']
+                continue
+            kept.append(seg)
+        for seg in provisional:
+            if cutoff is not None and seg['end'] <= cutoff or self.covered(kept, seg):
+                if seg['file'] and os.path.exists(os.path.join(self.dir, seg['file'])):
+                    os.remove(os.path.join(self.dir, seg['file']))
+                continue
+            kept.append(seg)
+        changed = len(kept) != len(self.segments)
+        self.segments = kept
+        return changed
+
+    @staticmethod
+    def covered(segments, seg):
+        """True se [start, end) di seg è coperto dai segmenti completi con gli stessi filtri."""
+        t = seg['start']
+        for other in sorted((o for o in segments if (o['prefix'], o['pattern']) == (seg['prefix'], seg['pattern'])
+                             and not o.get('provisional')), key=lambda o: o['start']):
+            if other['start'] > t:
+                break
+            t = max(t, other['end'])
+            if t >= seg['end']:
+                return True
+        return False
+
+    def save_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.segments, f)
+        os.replace(tmp, self.index_path)
+
+    @staticmethod
+    def compatible(seg, prefix, pattern):
+        if seg['pattern'] and seg['pattern'] != pattern:
+            return False
+        return not seg['prefix'] or bool(prefix and prefix.startswith(seg['prefix']))
+
+    def plan(self, start, end, prefix, pattern):
+        """
+        Divide [start, end) in intervalli (a, b, segmento): segmento None = da scaricare.
+        """
+        usable = sorted((seg for seg in self.segments
+                         if seg['end'] > start and seg['start'] < end and not seg.get('provisional')
+                         and self.compatible(seg, prefix, pattern)),
+                        key=lambda seg: seg['start'])
+        out = []
+        t = start
+        i = 0
+        best = None  # segmento con la fine più lontana tra quelli iniziati entro t
+        while t < end:
+            while i < len(usable) and usable[i]['start'] <= t:
+                if best is None or usable[i]['end'] > best['end']:
+                    best = usable[i]
+                i += 1
+            if best is not None and best['end'] > t:
+                b = min(best['end'], end)
+                out.append((t, b, best))
+            else:
+                b = min(usable[i]['start'], end) if i < len(usable) else end
+                out.append((t, b, None))
+            t = b
+        return out
+
+    def read(self, seg, start, end, prefix):
+        """Eventi del segmento in [start, end) e con stream che inizia per prefix."""
+        if not seg['file']:
+            return []
+        if prefix and not any(name.startswith(prefix) for name in seg['streams']):
+            return []
+        events = []
+        with aws_metrics.phase("archivio"), gzip.open(os.path.join(self.dir, seg['file']), 'rt', encoding='utf-8') as f:
+            for line in f:
+                event = json.loads(line)
+                if start <= event['timestamp'] < end and (not prefix or event['logStreamName'].startswith(prefix)):
+                    events.append(event)
+        return events
+
+    def store(self, start, end, events, prefix, pattern, save_index=True, provisional=False):
+        """
+        Salva un range scaricato per intero; l'ultimo minuto prima di adesso
+        resta fuori. Restituisce la fine effettivamente coperta.
+        provisional=True salva tutto il range come provvisorio (non serve richieste).
+        Con save_index=False l'indice va scritto dal chiamante (save_index()).
+        """
+        if not provisional:
+            end = min(end, int(time.time() * 1000) - ARCHIVE_SETTLE_MS)
+        if end <= start:
+            return start
+        events = [e for e in events if start <= e['timestamp'] < end]
+        seg = {'start': start, 'end': end, 'prefix': prefix, 'pattern': pattern,
+               'count': len(events), 'file': None, 'streams': []}
+        if provisional:
+            seg['provisional'] = True
+        if events:
+            n = len(self.segments)
+            while os.path.exists(os.path.join(self.dir, f"{start}-{end}-{n}.jsonl.gz")):
+                n += 1
+            seg['file'] = f"{start}-{end}-{n}.jsonl.gz"
+            seg['streams'] = sorted({e.get('logStreamName', 'unknown') for e in events})
+            with gzip.open(os.path.join(self.dir, seg['file']), 'wt', encoding='utf-8') as f:
+                f.write("".join(json.dumps({k: e.get(k) for k in ('timestamp', 'logStreamName', 'eventId', 'message')},
+                                           ensure_ascii=False) + "\n" for e in events))
+        self.segments.append(seg)
+        if save_index:
+            self.save_index()
+        return end
+
+    def tail_add(self, start, events):
+        if self.tail_from is None:
+            self.tail_from = start
+        self.tail_events.extend(events)
+
+    def tail_polled(self, cursor, polled_at):
+        """
+        Registra un ciclo del tail: la richiesta fatta a polled_at copre i
+        timestamp da cursor in poi, che sono assestati fino a polled_at -
+        ARCHIVE_SETTLE_MS. Il cursore del tail non torna indietro: un range
+        superato prima di essere assestato non viene più riletto e non può
+        essere segnato come completo (gli eventi ingeriti in ritardo mancano).
+        """
+        if self.tail_settled is None:
+            self.tail_settled = self.tail_from if self.tail_from is not None else cursor
+        if cursor <= self.tail_settled:
+            self.tail_settled = max(self.tail_settled, polled_at - ARCHIVE_SETTLE_MS)
+
+    def tail_flush(self, upto, prefix, pattern, force=False):
+        """
+        Chiude un segmento del tail live ogni ARCHIVE_SEGMENT_MS (o a fine esecuzione):
+        completo fino a dove il range è assestato, provvisorio per il resto.
+        """
+        if self.tail_from is None or (not force and upto - self.tail_from < ARCHIVE_SEGMENT_MS):
+            return
+        settled = max(self.tail_from, min(upto, self.tail_settled if self.tail_settled is not None else self.tail_from))
+        end = self.store(self.tail_from, settled, self.tail_events, prefix, pattern, save_index=False)
+        self.store(end, upto, self.tail_events, prefix, pattern, save_index=False, provisional=True)
+        self.save_index()
+        self.tail_events = [e for e in self.tail_events if e['timestamp'] >= upto]
+        self.tail_from = upto
+
+ARCHIVE = (LogArchive(args.archive_dir, LOG_GROUP or 'default', int(args.archive_keep_days * 86400 * 1000))
+           if args.archive_dir else None)
+
+def archive_filters(severity_filter):
+    """Prefisso stream e filterPattern della richiesta, come registrati nell'archivio."""
+    prefix = LOG_STREAM_FILTER if args.filter else None
+    pattern = f'"{severity_filter}"' if severity_filter else None
+    return prefix, pattern
+
+class SeenEvents:
+    """
+    Insieme limitato degli ultimi eventId visti (LRU): il tail riparte dal
+    timestamp dell'ultimo evento incluso e scarta quelli già stampati.
+    """
+
+    def __init__(self, maxlen=SEEN_EVENTS_MAX):
+        self.maxlen = maxlen
+        self.ids = OrderedDict()
+
+    def add(self, event_id):
+        """True se l'evento è nuovo."""
+        if event_id in self.ids:
+            self.ids.move_to_end(event_id)
+            return False
+        self.ids[event_id] = None
+        if len(self.ids) > self.maxlen:
+            self.ids.popitem(last=False)
+        return True
+
 def tail_log_with_filter(log_group, start_time, severity_filter=""):
     severity_filter = severity_filter.upper()
     print(f"📡 Tailing logs from group: {log_group}, filter: '{LOG_STREAM_FILTER}', since: {SINCE}")
 
-    next_token = None
+    seen = SeenEvents()
+    poll_secs = POLL_MIN_SECS
+    prefix, pattern = archive_filters(severity_filter)
 
     try:
         while True:
-            kwargs = {
-                'logGroupName': log_group,
-                'startTime': start_time,
-                'interleaved': True,
-            }
-
-            if args.filter:
-                kwargs['logStreamNamePrefix'] = LOG_STREAM_FILTER
+            # Ogni ciclo scarica tutte le pagine disponibili da start_time (incluso)
+            kwargs = filter_kwargs(log_group, start_time, severity_filter)
+            polled_from, polled_at = start_time, int(time.time() * 1000)
+            new_events = 0
+            while True:
+                with aws_metrics.phase("tail"):
+                    response = client.filter_log_events(**kwargs)
+                page = [event for event in response.get('events', []) if seen.add(event['eventId'])]
+                if page:
+                    render_events(page, severity_filter)
+                    if ARCHIVE:
+                        ARCHIVE.tail_add(start_time, page)
+                    new_events += len(page)
+                    start_time = max(start_time, max(e['timestamp'] for e in page))
+                next_token = response.get('nextToken')
+                if not next_token:
+                    break
+                kwargs['nextToken'] = next_token
 
-            if severity_filter:
-                kwargs['filterPattern'] = f'"{severity_filter}"'
+            if ARCHIVE:
+                ARCHIVE.tail_add(start_time, [])
+                ARCHIVE.tail_polled(polled_from, polled_at)
+                ARCHIVE.tail_flush(start_time, prefix, pattern)
 
-            if next_token:
-                kwargs['nextToken'] = next_token
-                        
-            response = client.filter_log_events(**kwargs)
-            events = response.get('events', [])
-            new_token = response.get('nextToken')
-
-            if events:
-                for event in events:
-                    ts = datetime.datetime.utcfromtimestamp(event['timestamp'] / 1000.0)
-                    log_stream = event.get('logStreamName', 'unknown')
-
-                    msg = event['message'].strip()
-
-                    # Prova a parsare JSON per estrarre 'log'
-                    try:
-                        parsed = json.loads(msg)
-                        log_line = str(parsed.get('log', msg))  # forza in stringa
-                    except json.JSONDecodeError:
-                        log_line = msg
-
-
-                    # Filtro manuale se filterPattern non trova tutto
-                    if severity_filter and severity_filter not in log_line.upper():
-                        continue
-
-                    label = "INIT"
-                    # Se singolo filtro stream non uso la logica delle label
-                    if args.filter:
-                        if re.search(r'\] *ERROR\b', log_line, re.IGNORECASE):
-                            label = "❌❌❌ ERROR"
-                        else:
-                            label = ""
-                    else:
-                        if "infocamere" in log_stream.lower():
-                            label = "📤 InfoCamere"
-                        elif "crm" in log_stream.lower():
-                            label = "📦 Crm"
-                        elif "cdp" in log_stream.lower():
-                            label = "👁️ CDP"
-                        elif "utility" in log_stream.lower():
-                            label = "🔍 Utility"
-                        elif "google" in log_stream.lower():
-                            label = "🌎 Google"
-                        elif "cammini" in log_stream.lower():
-                            label = "🦶 Cammini"
-                        elif "ristoranti" in log_stream.lower():
-                            label = "🍕 Ristoranti"
-                        elif "datalake" in log_stream.lower():
-                            label = "🌊 DataLake"
-                        elif "aem" in log_stream.lower():
-                            label = "📊 AEM"
-                        elif "esperienze" in log_stream.lower():
-                            label = "🧩 Esperienze"
-                        elif "tools" in log_stream.lower():
-                            label = "⚙️ tools"
-                        elif "kube-proxy" in log_stream.lower():
-                            label = "kube-proxy"
-                        elif "aws-load-balancer-controller" in log_stream.lower():
-                            label = "ELB"
-                        else:
-                            label = "___"+log_stream
-
-
-                    # Sovrascrive la label se c'è un errore
-                    # Se il log o lo stream contengono "error", sovrascrive la label
-                    if error_pattern.search(log_line):
-                        label = f"❌❌❌ ERROR -  {label}"
-                    elif warn_pattern.search(log_line):
-                        label = f"⚠️⚠️⚠️ WARN - {label}"
-                        
-                    # Suddividi in righe solo per la stampa
-                    lines = log_line.splitlines()
-                    # if lines:
-                    #     first_line = lines[0]
-                    #     print(f"{label} {first_line}", flush=True)
-                    #     for line in lines[1:]:
-                    #         print(f"│   {line}", flush=True) # solo indentazione, nessuna label ripetuta
-                    
-                    if lines:
-                        for line in lines:
-                            if date_pattern.match(line):
-                                # nuova entry: etichetta e linea intera
-                                print(f"{label} {line}", flush=True)
-                            else:
-                                # continuation: solo indentazione
-                                print(f"│   {line}", flush=True)
-
-
-                start_time = events[-1]['timestamp'] + 1  # per evitare duplicati
+            if new_events:
+                poll_secs = POLL_MIN_SECS
             else:
-                print(f"⏳ Nessun nuovo log negli ultimi {TIMEOUT_SECS} secondi...")
-
-            
-            time.sleep(TIMEOUT_SECS)
+                print(f"⏳ Nessun nuovo log negli ultimi {poll_secs} secondi...")
+                poll_secs = min(poll_secs * 2, TIMEOUT_SECS)
 
-            next_token = new_token
+            time.sleep(poll_secs)
 
     except KeyboardInterrupt:
         print("\n🛑 Interrotto dall'utente.")
     except Exception as e:
         print("❌ Errore:", e)
         print("Wait for 5 minutes or try to execute -> podman machine stop && podman machine start")
+    finally:
+        if ARCHIVE:
+            ARCHIVE.tail_flush(start_time, prefix, pattern, force=True)
 
 def list_log_groups(region='eu-south-1'):
     """
     Restituisce una lista dei nomi dei log group nella regione specificata.
     """
     try:
-        client = boto3.client('logs', region_name=region)
+        client = aws_clients.get_client('logs', region=region)
         log_groups = []
         paginator = client.get_paginator('describe_log_groups')
 
@@ -249,8 +861,41 @@ def print_log_groups():
     for lg in log_groups:
         print(f" - {lg}")
 
+def on_sigterm(signum, frame):
+    """podman stop: si esce dai cicli come con Ctrl-C, così archivio e sink vengono chiusi nei finally."""
+    raise KeyboardInterrupt
+
+def print_metrics():
+    print("-" * 50)
+    print("📈 Metriche API:")
+    for line in metrics.summary_lines():
+        print(line)
+    if args.metrics_out:
+        metrics.write(args.metrics_out)
+        print(f"💾 Snapshot metriche: {args.metrics_out}")
+
 def tail_log_with_filter_init():
-    tail_log_with_filter(LOG_GROUP, start_time, args.severity)
+    tail_start = start_time
+    signal.signal(signal.SIGTERM, on_sigterm)
+    stop_reporter = metrics.start_reporter(args.metrics_interval) if metrics and args.metrics_interval > 0 else None
+    try:
+        if args.backfill_workers > 1 or args.backfill_streams or ARCHIVE:
+            try:
+                tail_start = backfill(LOG_GROUP, start_time, args.severity.upper())
+            except KeyboardInterrupt:
+                print("\n🛑 Interrotto dall'utente.")
+                return
+            except (BotoCoreError, ClientError) as e:
+                print(f"❌ Errore AWS durante il backfill: {e}")
+                return
+        tail_log_with_filter(LOG_GROUP, tail_start, args.severity)
+    finally:
+        for sink in SINKS:
+            sink.close()
+        if stop_reporter:
+            stop_reporter()
+        if metrics:
+            print_metrics()
 
 # def tail_log_init():
 #     stream = get_first_stream_with_events()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Client AWS condivisi dagli script del toolkit.
+
+- boto3 viene importato e il client creato solo al primo utilizzo
+  (`--help` e gli errori sugli argomenti non pagano il setup di boto3);
+- un client per (servizio, regione, configurazione dei retry) per processo,
+  usabile da tutti i thread: i client boto3 sono thread-safe e così i worker
+  condividono un solo pool;
+- max_pool_connections dimensionato sul numero di worker: se una richiesta
+  successiva chiede più connessioni il client viene ricreato più grande;
+- retry "adaptive" di botocore (backoff + rate limiting lato client);
+- se attive (aws_metrics.enable()), gli hook delle metriche vengono agganciati
+  a ogni client creato.
+
+Nei container il file viene copiato accanto allo script; in locale gli script
+aggiungono la cartella common/ al path.
+"""
+import os
+import threading
+import weakref
+
+import aws_metrics
+
+DEFAULT_MAX_ATTEMPTS = 10
+
+_clients = {}
+_lock = threading.Lock()
+# LazyClient in uso: la loro cache di attributi va svuotata quando un client
+# viene sostituito (pool ingrandito) o nei figli dopo un fork
+_lazy_clients = weakref.WeakSet()
+
+
+def _reset_lazy_clients():
+    for lazy in list(_lazy_clients):
+        lazy._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lazy_clients)
+
+
+def get_client(service, region=None, max_workers=10, retry_mode="adaptive", max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Client boto3 per service/region con almeno max_workers connessioni nel pool.
+    region None = regione dell'ambiente (AWS_DEFAULT_REGION / profilo).
+    """
+    # pid nella chiave: dopo un fork i figli non riusano i socket del padre.
+    # La configurazione dei retry fa parte della chiave: chi chiede retry
+    # diversi (es. rename_segment) non eredita quelli del primo chiamante
+    key = (service, region, retry_mode, max_attempts, os.getpid())
+    entry = _clients.get(key)
+    pool_size = max(10, max_workers)
+    if entry and entry[0] >= pool_size:
+        return entry[1]
+
+    with _lock:
+        entry = _clients.get(key)
+        if entry and entry[0] >= pool_size:
+            return entry[1]
+        import boto3
+        from botocore.config import Config
+
+        config = Config(
+            max_pool_connections=pool_size,
+            retries={"mode": retry_mode, "max_attempts": max_attempts},
+        )
+        # Una sessione per client: le sessioni boto3 non sono thread-safe
+        client = boto3.session.Session().client(service, region_name=region, config=config)
+        aws_metrics.instrument(client)
+        replaced = key in _clients
+        _clients[key] = (pool_size, client)
+        if replaced:
+            _reset_lazy_clients()
+        return client
+
+
+class LazyClient:
+    """
+    Segnaposto per i client a livello di modulo: il client vero viene creato
+    (o preso dalla cache) al primo attributo richiesto, es. s3.list_objects_v2.
+    Gli attributi risolti vengono salvati sull'istanza, così gli accessi
+    successivi non passano da __getattr__; la cache viene svuotata se il
+    client viene sostituito (pool ingrandito) o dopo un fork.
+    """
+
+    _OWN = ("_service", "_kwargs")
+
+    def __init__(self, service, **kwargs):
+        self._service = service
+        self._kwargs = kwargs
+        _lazy_clients.add(self)
+
+    def _reset(self):
+        for name in [n for n in vars(self) if n not in self._OWN]:
+            self.__dict__.pop(name, None)
+
+    def __getattr__(self, name):
+        value = getattr(get_client(self._service, **self._kwargs), name)
+        self.__dict__[name] = value
+        return value
+
+
+def lazy_client(service, **kwargs):
+    """Come get_client, ma il client viene creato solo al primo utilizzo."""
+    return LazyClient(service, **kwargs)
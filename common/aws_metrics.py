@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Metriche delle chiamate AWS fatte dagli script del toolkit.
+
+- raccolta tramite gli hook di botocore (before-call, before-send, needs-retry,
+  after-call, after-call-error) sui client creati da aws_clients.get_client:
+  nessuna modifica ai punti in cui gli script chiamano le API;
+- per operazione: chiamate, tentativi HTTP, errori per codice, retry,
+  risposte di throttling e istogramma delle latenze (bucket fissi);
+- timer per fase (tempo cumulato dei thread dentro la fase);
+- righe di avanzamento periodiche e snapshot finale in formato
+  Prometheus (testo) o JSON.
+
+Disattivato finché uno script non chiama enable(): phase() e timed_iter()
+diventano no-op e i client non vengono agganciati.
+"""
+import bisect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Limite superiore (secondi) dei bucket di latenza: da 1 ms a ~46 s in passi di
+# radice di 2 (errore dei quantili entro metà bucket); l'ultimo bucket è +Inf
+LATENCY_BUCKETS = tuple(round(0.001 * 2 ** (i / 2), 6) for i in range(32))
+THROTTLE_CODES = {"SlowDown", "ServiceUnavailable", "Throttling", "ThrottlingException",
+                  "RequestLimitExceeded", "TooManyRequests", "RequestThrottled"}
+THROTTLE_STATUS = {429, 503}
+# Operazioni mostrate nelle righe di avanzamento (le più chiamate)
+PROGRESS_TOP_OPS = 3
+
+REGISTRY = None
+
+
+class Histogram:
+    """
+    Istogramma a bucket fissi. I quantili sono interpolati linearmente dentro
+    il bucket, come histogram_quantile di Prometheus, e limitati a minimo e massimo visti.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = max(LATENCY_BUCKETS[i - 1] if i else 0.0, self.min)
+                upper = min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+class OpStats:
+    __slots__ = ("calls", "attempts", "errors", "retries", "throttled", "codes", "latency")
+
+    def __init__(self):
+        self.calls = 0
+        self.attempts = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.codes = {}
+        self.latency = Histogram()
+
+
+def _op_key(event_name: str):
+    # es. "after-call.s3.CopyObject" -> ("s3", "CopyObject")
+    _, service, operation = event_name.split(".", 2)
+    return service, operation
+
+
+class Metrics:
+    """Registro delle metriche di un processo, condiviso da tutti i thread."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ops = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, event_name: str) -> OpStats:
+        key = _op_key(event_name)
+        stats = self.ops.get(key)
+        if stats is None:
+            stats = self.ops.setdefault(key, OpStats())
+        return stats
+
+    # --- hook botocore -------------------------------------------------
+
+    def instrument(self, client):
+        events = client.meta.events
+        events.register("before-call", self._before_call)
+        events.register("before-send", self._before_send)
+        events.register("needs-retry", self._needs_retry)
+        events.register("after-call", self._after_call)
+        events.register("after-call-error", self._after_call_error)
+
+    def _before_call(self, context=None, **kwargs):
+        if context is not None:
+            context["metrics_started"] = time.perf_counter()
+
+    def _before_send(self, event_name, **kwargs):
+        stats = self._stats(event_name)
+        with self._lock:
+            stats.attempts += 1
+
+    def _needs_retry(self, event_name, response=None, **kwargs):
+        # chiamato dopo ogni tentativo: qui si vede anche il throttling assorbito dai retry
+        if response is None:
+            return None
+        http, parsed = response
+        code = parsed.get("Error", {}).get("Code")
+        if http.status_code in THROTTLE_STATUS or code in THROTTLE_CODES:
+            stats = self._stats(event_name)
+            with self._lock:
+                stats.throttled += 1
+        return None
+
+    def _finish(self, event_name, context, code, retries):
+        started = context.get("metrics_started") if context else None
+        elapsed = time.perf_counter() - started if started is not None else None
+        stats = self._stats(event_name)
+        with self._lock:
+            stats.calls += 1
+            stats.retries += retries
+            if code is not None:
+                stats.errors += 1
+                stats.codes[code] = stats.codes.get(code, 0) + 1
+            if elapsed is not None:
+                stats.latency.observe(elapsed)
+
+    def _after_call(self, event_name, http_response=None, parsed=None, context=None, **kwargs):
+        parsed = parsed or {}
+        code = None
+        if http_response is not None and http_response.status_code >= 300:
+            code = parsed.get("Error", {}).get("Code") or str(http_response.status_code)
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        self._finish(event_name, context, code, retries)
+
+    def _after_call_error(self, event_name, exception=None, context=None, **kwargs):
+        # errori senza risposta HTTP (connessione, timeout) dopo i retry di botocore
+        self._finish(event_name, context, type(exception).__name__, 0)
+
+    # --- fasi ----------------------------------------------------------
+
+    def add_phase(self, name: str, seconds: float, calls: int = 1):
+        with self._lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                self.phases[name] = [calls, seconds]
+            else:
+                entry[0] += calls
+                entry[1] += seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started)
+
+    def timed_iter(self, name: str, iterable):
+        """Conta nella fase il tempo speso ad aspettare ogni elemento di iterable."""
+        it = iter(iterable)
+        spent = 0.0
+        calls = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    spent += time.perf_counter() - started
+                    return
+                spent += time.perf_counter() - started
+                calls += 1
+                yield item
+        finally:
+            self.add_phase(name, spent, calls)
+
+    # --- export --------------------------------------------------------
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            ops = []
+            for (service, operation), s in sorted(self.ops.items()):
+                h = s.latency
+                ops.append({
+                    "service": service,
+                    "operation": operation,
+                    "calls": s.calls,
+                    "attempts": s.attempts,
+                    "errors": s.errors,
+                    "error_codes": dict(s.codes),
+                    "retries": s.retries,
+                    "throttled": s.throttled,
+                    "latency": {
+                        "count": h.count,
+                        "sum": round(h.total, 6),
+                        "max": round(h.max, 6),
+                        "p50": round(h.quantile(0.50), 6),
+                        "p95": round(h.quantile(0.95), 6),
+                        "p99": round(h.quantile(0.99), 6),
+                        "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], h.counts)),
+                    },
+                })
+            phases = {name: {"calls": c, "seconds": round(sec, 6)} for name, (c, sec) in sorted(self.phases.items())}
+        return {"uptime_seconds": round(time.monotonic() - self.started, 3), "operations": ops, "phases": phases}
+
+    def to_prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(op, **extra):
+            pairs = [("service", op["service"]), ("operation", op["operation"])] + list(extra.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        for field, help_text in (("calls", "Chiamate API completate"),
+                                 ("attempts", "Richieste HTTP inviate, retry compresi"),
+                                 ("retries", "Retry fatti da botocore"),
+                                 ("throttled", "Risposte di throttling ricevute")):
+            name = f"aws_api_{field}_total"
+            family(name, "counter", help_text)
+            lines.extend(f"{name}{labels(op)} {op[field]}" for op in snap["operations"])
+
+        family("aws_api_errors_total", "counter", "Chiamate API fallite per codice di errore")
+        for op in snap["operations"]:
+            lines.extend(f"aws_api_errors_total{labels(op, code=code)} {n}" for code, n in sorted(op["error_codes"].items()))
+
+        family("aws_api_latency_seconds", "histogram", "Latenza delle chiamate API, retry compresi")
+        for op in snap["operations"]:
+            cumulative = 0
+            for le, n in op["latency"]["buckets"].items():
+                cumulative += n
+                lines.append(f"aws_api_latency_seconds_bucket{labels(op, le=le)} {cumulative}")
+            lines.append(f"aws_api_latency_seconds_sum{labels(op)} {op['latency']['sum']}")
+            lines.append(f"aws_api_latency_seconds_count{labels(op)} {op['latency']['count']}")
+
+        family("toolkit_phase_seconds_total", "counter", "Tempo cumulato dei thread per fase")
+        lines.extend(f'toolkit_phase_seconds_total{{phase="{p}"}} {v["seconds"]}' for p, v in snap["phases"].items())
+        family("toolkit_phase_calls_total", "counter", "Ingressi nella fase")
+        lines.extend(f'toolkit_phase_calls_total{{phase="{p}"}} {v["calls"]}' for p, v in snap["phases"].items())
+        family("toolkit_uptime_seconds", "gauge", "Secondi dall'attivazione delle metriche")
+        lines.append(f"toolkit_uptime_seconds {snap['uptime_seconds']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Snapshot su file: JSON se l'estensione è .json, altrimenti testo Prometheus."""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                json.dump(self.snapshot(), f, indent=2)
+                f.write("\n")
+            else:
+                f.write(self.to_prometheus())
+
+    def progress_line(self, extra: str = "") -> str:
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            ops = sorted(self.ops.items(), key=lambda kv: kv[1].calls, reverse=True)
+            calls = sum(s.calls for _, s in ops)
+            errors = sum(s.errors for _, s in ops)
+            retries = sum(s.retries for _, s in ops)
+            throttled = sum(s.throttled for _, s in ops)
+            top = [f"{op} {s.calls} p50 {s.latency.quantile(0.5) * 1000:.0f}ms p95 {s.latency.quantile(0.95) * 1000:.0f}ms"
+                   for (_, op), s in ops[:PROGRESS_TOP_OPS] if s.calls]
+        parts = [f"[METRICHE] {elapsed:.0f}s", f"{calls} chiamate ({calls / elapsed if elapsed else 0:.1f}/s)",
+                 f"errori {errors}", f"retry {retries}", f"throttling {throttled}"]
+        if extra:
+            parts.append(extra)
+        return " | ".join(parts + top)
+
+    def summary_lines(self) -> list:
+        """Riepilogo finale leggibile: una riga per operazione e una per fase."""
+        snap = self.snapshot()
+        lines = []
+        for op in snap["operations"]:
+            lat = op["latency"]
+            avg = lat["sum"] / lat["count"] if lat["count"] else 0.0
+            line = (f"  {op['operation']}: {op['calls']} chiamate, {op['attempts']} richieste HTTP, "
+                    f"errori {op['errors']}, retry {op['retries']}, throttling {op['throttled']}, "
+                    f"media {avg * 1000:.0f}ms p50 {lat['p50'] * 1000:.0f}ms "
+                    f"p95 {lat['p95'] * 1000:.0f}ms p99 {lat['p99'] * 1000:.0f}ms")
+            if op["error_codes"]:
+                line += " (" + ", ".join(f"{c}: {n}" for c, n in sorted(op["error_codes"].items())) + ")"
+            lines.append(line)
+        for name, p in snap["phases"].items():
+            lines.append(f"  fase {name}: {p['seconds']:.2f}s in {p['calls']} passaggi")
+        return lines
+
+    def start_reporter(self, interval: float, extra=None, out=None):
+        """
+        Stampa progress_line ogni interval secondi in un thread daemon.
+        extra: funzione senza argomenti che restituisce testo da aggiungere alla riga.
+        Restituisce la funzione che ferma il thread.
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                print(self.progress_line(extra() if extra else ""), file=out or sys.stdout, flush=True)
+
+        threading.Thread(target=run, name="metrics-reporter", daemon=True).start()
+        return stop.set
+
+
+def enable() -> Metrics:
+    """Attiva la raccolta: va chiamata prima di creare i client con aws_clients."""
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = Metrics()
+    return REGISTRY
+
+
+def instrument(client):
+    """Aggancia gli hook al client se le metriche sono attive (usata da aws_clients)."""
+    if REGISTRY is not None:
+        REGISTRY.instrument(client)
+
+
+def phase(name: str):
+    return REGISTRY.phase(name) if REGISTRY is not None else nullcontext()
+
+
+def timed_iter(name: str, iterable):
+    return REGISTRY.timed_iter(name, iterable) if REGISTRY is not None else iterable
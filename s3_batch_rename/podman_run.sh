@@ -12,12 +12,17 @@ IMAGE_NAME="s3-multireplace"
 # Build immagine se non esiste
 if ! podman image exists "$IMAGE_NAME"; then
     echo "Costruisco immagine $IMAGE_NAME..."
-    podman build -t "$IMAGE_NAME" .
+    # Contesto = radice del repo, per includere common/aws_clients.py
+    podman build -t "$IMAGE_NAME" -f Dockerfile ..
 fi
 
+# Cartella di lavoro persistente (journal per RESUME)
+mkdir -p work
+
 # Esegui container
 podman run --rm \
     --name s3-rename \
+    -v "$PWD/work:/app/work:Z" \
     --env AWS_REGION \
     --env AWS_ACCESS_KEY_ID \
     --env AWS_SECRET_ACCESS_KEY \
@@ -29,4 +34,11 @@ podman run --rm \
     --env DRY_RUN \
     --env MAX_WORKERS \
     --env ALLOW_COLLISIONS \
+    --env MULTIPART_THRESHOLD_MB \
+    --env PART_SIZE_MB \
+    --env JOURNAL_PATH \
+    --env RESUME \
+    --env RULES_FILE \
+    --env METRICS_INTERVAL \
+    --env METRICS_OUT \
     "$IMAGE_NAME"
@@ -1,11 +1,59 @@
 #!/usr/bin/env python3
 import os
-import boto3
-from botocore.exceptions import ClientError
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from collections import Counter, defaultdict
-
-s3 = boto3.client("s3")
+import re
+import sys
+import json
+import heapq
+import queue
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import groupby
+
+# Factory client condivisa (common/aws_clients.py; nel container è copiata accanto allo script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import aws_clients
+import aws_metrics
+
+# Retry di botocore ridotti al minimo: il throttling deve arrivare subito ad
+# AdaptiveConcurrency, che fa backoff per prefisso e riduce la concorrenza
+S3_CLIENT_OPTIONS = {"retry_mode": "standard", "max_attempts": 2}
+s3 = aws_clients.lazy_client("s3", **S3_CLIENT_OPTIONS)
+
+# Operazioni in volo per worker prima che il listing si fermi ad aspettare
+QUEUE_PER_WORKER = 4
+# Operazioni pianificate tenute in RAM prima di scrivere un run ordinato su disco
+RUN_SIZE = 100_000
+# delete_objects accetta al massimo 1000 chiavi per richiesta
+DELETE_BATCH_SIZE = 1000
+DELETE_WORKERS = 4
+# Secondi di attesa massima prima di inviare un batch di delete non pieno
+DELETE_MAX_WAIT = 1.0
+# Oltre questa dimensione si copia con multipart (copy_object fallisce sopra 5 GB)
+MULTIPART_THRESHOLD = 1024 * 1024 * 1024
+MULTIPART_PART_SIZE = 128 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10_000
+PART_WORKERS = 16
+# fsync del journal ogni N record (oltre a quello prima di ogni batch di delete)
+JOURNAL_SYNC_EVERY = 10_000
+# Controllo adattivo della concorrenza (AIMD) e backoff sul throttling
+THROTTLE_CODES = {"SlowDown", "ServiceUnavailable", "Throttling", "ThrottlingException",
+                  "RequestLimitExceeded", "TooManyRequests"}
+MAX_RETRIES = 8
+BACKOFF_BASE = 0.2           # secondi, raddoppia a ogni throttling consecutivo sullo stesso prefisso
+BACKOFF_CAP = 20.0
+DECREASE_FACTOR = 0.5        # riduzione moltiplicativa del limite su throttling
+DECREASE_COOLDOWN = 2.0      # al massimo una riduzione ogni N secondi
+LATENCY_TOLERANCE = 2.0      # si aumenta solo se la latenza è sotto N volte la migliore vista
+LATENCY_SIZE_UNIT = 16 * 1024 * 1024  # la latenza di una copia viene normalizzata per blocchi di 16 MiB
+# Header che MetadataDirective="COPY" riporta sulla destinazione
+COPIED_HEADERS = ("ContentType", "ContentEncoding", "ContentDisposition", "ContentLanguage",
+                  "CacheControl", "Expires", "WebsiteRedirectLocation")
 
 
 def str_to_bool(v: str | None, default: bool) -> bool:
@@ -14,18 +62,639 @@ def str_to_bool(v: str | None, default: bool) -> bool:
     return v.strip().lower() in ("1", "true", "yes", "y")
 
 
+class SegmentRules:
+    """
+    Regole old_segment -> new_segment applicate in un'unica scansione della chiave.
+    I segmenti stanno in un trie; le posizioni candidate (dove inizia almeno un
+    segmento) si trovano con una regex sui primi caratteri, poi dal trie si prende
+    il match più lungo. Precedenza: match più a sinistra, poi segmento più lungo,
+    a parità di segmento vince la prima regola. I match non si sovrappongono e il
+    testo sostituito non viene riesaminato, come str.replace.
+    Con share_slash=True (file di regole) fa eccezione la '/' di confine: se un
+    match finisce con '/' e il successivo inizia con la stessa '/' (entrambe le
+    regole delimitate da '/' anche nel nuovo segmento) la barra è condivisa,
+    così in 'x/2023/tmp/f' si applicano sia '/2023/' che '/tmp/'.
+    """
+
+    _END = ""  # chiave del nodo terminale (i figli hanno chiavi di un carattere)
+
+    def __init__(self, rules, share_slash: bool = True):
+        self.rules = []
+        self.trie = {}
+        for old, new in rules:
+            if not old:
+                raise ValueError("Regola con segmento vuoto")
+            if old == new:
+                print(f"Regola ignorata (nessuna modifica): {old!r}")
+                continue
+            node = self.trie
+            for ch in old:
+                node = node.setdefault(ch, {})
+            if self._END in node:
+                print(f"Regola duplicata ignorata: {old!r} -> {new!r}")
+                continue
+            node[self._END] = len(self.rules)
+            self.rules.append((old, new))
+        # regole che possono condividere la '/' finale / iniziale con il match adiacente
+        self.shares_end = [share_slash and old.endswith("/") and new.endswith("/") for old, new in self.rules]
+        self.shares_start = [share_slash and old.startswith("/") and new.startswith("/") for old, new in self.rules]
+        self.starts = re.compile("[" + "".join(re.escape(ch) for ch in self.trie) + "]") if self.trie else None
+        # nuovo segmento -> quante regole lo producono
+        self.new_segments = {}
+        for _, new in self.rules:
+            self.new_segments[new] = self.new_segments.get(new, 0) + 1
+
+    @classmethod
+    def from_file(cls, path: str):
+        """Una regola per riga nel formato 'old -> new'; righe vuote e '#' ignorate."""
+        rules = []
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, 1):
+                line = line.rstrip("\r\n")
+                if not line.strip() or line.lstrip().startswith("#"):
+                    continue
+                if " -> " not in line:
+                    raise ValueError(f"{path}:{n}: formato atteso 'old -> new'")
+                old, new = line.split(" -> ", 1)
+                rules.append((old.strip(), new.strip()))
+        return cls(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def single_source(self, new_key: str) -> bool:
+        """
+        True se new_key può essere prodotta da una sola chiave sorgente: contiene
+        una sola occorrenza (contando anche quelle sovrapposte) di un nuovo
+        segmento, generato da una sola regola. La sorgente è allora fissata
+        (stessi pezzi prima e dopo, con il vecchio segmento al posto del nuovo)
+        e la destinazione non può essere in collisione con nessun'altra chiave.
+        """
+        found = 0
+        for new, count in self.new_segments.items():
+            i = new_key.find(new)
+            while i >= 0:
+                found += count
+                if found > 1:
+                    return False
+                i = new_key.find(new, i + 1)
+        return found == 1
+
+    def apply(self, key: str) -> str:
+        """Chiave con tutte le regole applicate (identica se nessuna regola corrisponde)."""
+        if len(self.rules) == 1:
+            old, new = self.rules[0]
+            if old not in key:
+                return key
+            if not (self.shares_end[0] and self.shares_start[0]):
+                return key.replace(old, new)
+        if self.starts is None:
+            return key
+
+        out = []
+        pos = 0
+        shared = False  # l'ultimo match finisce con una '/' condivisibile (key[pos - 1])
+        n = len(key)
+        for m in self.starts.finditer(key):
+            i = m.start()
+            overlap = i == pos - 1 and shared
+            if i < pos and not overlap:
+                continue  # dentro un match già sostituito
+            node = self.trie
+            j = i
+            best = None
+            while j < n:
+                node = node.get(key[j])
+                if node is None:
+                    break
+                j += 1
+                if self._END in node and (not overlap or self.shares_start[node[self._END]]):
+                    best = (j, node[self._END])
+            if best:
+                rule = best[1]
+                new = self.rules[rule][1]
+                if overlap:
+                    out.append(new[1:])  # la '/' iniziale è già nel nuovo segmento precedente
+                else:
+                    out.append(key[pos:i])
+                    out.append(new)
+                pos = best[0]
+                shared = self.shares_end[rule]
+        if not out:
+            return key
+        out.append(key[pos:])
+        return "".join(out)
+
+
+class OwnDestinations:
+    """
+    Destinazioni già copiate (o in volo) in questo run che il listing non ha
+    ancora raggiunto. Le copie partono mentre il listing è in corso: una
+    destinazione che corrisponde ancora a una regola (es. '/2023/' ->
+    '/archive/2023/') verrebbe listata e rinominata di nuovo, a cascata.
+    Il listing è in ordine di chiave, quindi basta un heap delle destinazioni
+    successive alla chiave corrente: quelle già superate vengono scartate.
+    """
+
+    def __init__(self, rules: SegmentRules, search_prefix: str | None):
+        self.rules = rules
+        self.prefix = search_prefix or ""
+        self.heap = []
+        self.skipped = 0
+
+    def add(self, old_key: str, new_key: str):
+        # solo le destinazioni che il listing incontrerà e che verrebbero rinominate
+        if new_key > old_key and new_key.startswith(self.prefix) and self.rules.apply(new_key) != new_key:
+            heapq.heappush(self.heap, new_key)
+
+    def seen(self, key: str) -> bool:
+        """True se la chiave listata è una destinazione di questo run."""
+        heap = self.heap
+        while heap and heap[0] < key:
+            heapq.heappop(heap)
+        if heap and heap[0] == key:
+            heapq.heappop(heap)
+            self.skipped += 1
+            return True
+        return False
+
+
+def iter_plan(bucket: str, rules: SegmentRules, search_prefix: str | None,
+              own: OwnDestinations | None = None):
+    """
+    Lista il bucket pagina per pagina e produce (old_key, new_key, size_bytes).
+    Le chiavi in `own` (destinazioni create da questo run) vengono saltate.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+    pages = paginator.paginate(Bucket=bucket, Prefix=search_prefix or "")
+
+    for page in pages:
+        for obj in page.get("Contents", []):
+            old_key = obj["Key"]
+            if own is not None and own.seen(old_key):
+                continue
+
+            new_key = rules.apply(old_key)
+
+            if new_key == old_key:
+                continue
+
+            yield old_key, new_key, obj.get("Size", 0)
+
+
+def _write_run(run: list, tmpdir: str, n: int) -> str:
+    run.sort(key=lambda t: (t[1], t[0]))
+    path = os.path.join(tmpdir, f"run-{n:05d}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for t in run:
+            f.write(json.dumps(t) + "\n")
+    return path
+
+
+def _read_run(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+class DestinationRuns:
+    """
+    Operazioni ordinate per chiave di destinazione con run ordinati su disco
+    (memoria limitata a run_size operazioni), fusi con heapq.merge.
+    """
+
+    def __init__(self, tmpdir: str, run_size: int = RUN_SIZE):
+        self.tmpdir = tmpdir
+        self.run_size = run_size
+        self.runs = []
+        self.run = []
+
+    def add(self, op: tuple):
+        self.run.append(op)
+        if len(self.run) >= self.run_size:
+            self.runs.append(_write_run(self.run, self.tmpdir, len(self.runs)))
+            self.run = []
+
+    def groups(self):
+        """Produce (new_key, [(old_key, new_key, size), ...]) per ogni destinazione."""
+        if self.run:
+            self.runs.append(_write_run(self.run, self.tmpdir, len(self.runs)))
+            self.run = []
+        merged = heapq.merge(*(_read_run(p) for p in self.runs), key=lambda t: (t[1], t[0]))
+        for new_key, group in groupby(merged, key=lambda t: t[1]):
+            yield new_key, list(group)
+
+
+def is_throttle(e: ClientError) -> bool:
+    """True per gli errori di throttling (503 SlowDown e simili) da ritentare."""
+    code = e.response.get("Error", {}).get("Code")
+    status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in THROTTLE_CODES or status in (429, 503)
+
+
+def throttle_prefix(key: str) -> str:
+    """Prefisso su cui S3 applica il throttling: la 'cartella' della chiave."""
+    return key.rsplit("/", 1)[0] if "/" in key else ""
+
+
+class AdaptiveConcurrency:
+    """
+    Limite di copie in volo regolato in stile AIMD: +1/limite a ogni copia
+    riuscita con latenza sana, dimezzamento quando arriva throttling.
+    Tiene anche un backoff esponenziale con jitter per prefisso, così un
+    prefisso caldo rallenta senza fermare gli altri.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, self.max_limit // 4))
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.peak = 0
+        self.latency = None       # media mobile esponenziale
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self.backoff = {}         # prefisso -> (attesa fino a, throttling consecutivi)
+        self.throttled = 0
+        self.retries = 0
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self, latency: float | None = None):
+        """Libera uno slot; latency (normalizzata) alimenta l'aumento additivo."""
+        with self.cond:
+            self.in_flight -= 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+                self.best_latency = min(self.best_latency or self.latency, self.latency)
+                if self.latency <= LATENCY_TOLERANCE * self.best_latency:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def on_throttle(self, prefix: str) -> float:
+        """Registra un throttling: riduce il limite e allunga il backoff del prefisso."""
+        with self.cond:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self.last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                self.last_decrease = now
+            _, streak = self.backoff.get(prefix, (0.0, 0))
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** streak))  # full jitter
+            self.backoff[prefix] = (now + delay, streak + 1)
+            return delay
+
+    def wait_prefix(self, prefix: str):
+        """Attende la fine del backoff del prefisso, se presente."""
+        entry = self.backoff.get(prefix)
+        if entry:
+            delay = entry[0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def on_success(self, prefix: str):
+        if prefix in self.backoff:
+            with self.cond:
+                self.backoff.pop(prefix, None)
+
+    def call(self, prefix: str, fn, *args, **kwargs):
+        """Esegue fn ritentando con backoff e jitter se S3 risponde con throttling."""
+        attempt = 0
+        while True:
+            self.wait_prefix(prefix)
+            try:
+                result = fn(*args, **kwargs)
+            except ClientError as e:
+                if not is_throttle(e) or attempt >= MAX_RETRIES:
+                    raise
+                attempt += 1
+                with self.cond:
+                    self.retries += 1
+                self.on_throttle(prefix)
+                continue
+            self.on_success(prefix)
+            return result
+
+
+class RenameJournal:
+    """
+    Journal append-only (JSONL) dello stato di ogni chiave: pianificata (P),
+    copiata (C), cancellata (D), più un record E a piano completo.
+    Le scritture restano nel buffer del file; fsync ogni JOURNAL_SYNC_EVERY
+    record e prima di ogni batch di delete, così una sorgente viene cancellata
+    solo dopo che la sua copia è registrata su disco.
+    """
+
+    PLANNED, COPIED, DELETED, PLAN_DONE = "P", "C", "D", "E"
+
+    def __init__(self, path: str, header: dict, resume: bool, readonly: bool = False,
+                 sync_every: int = JOURNAL_SYNC_EVERY):
+        self.path = path
+        self.sync_every = sync_every
+        self.keys = {}              # old_key -> [new_key, size, stato], solo in ripresa
+        self.destinations = set()   # destinazioni già pianificate nel run precedente
+        self.plan_complete = False
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.file = None
+
+        exists = os.path.exists(path)
+        if resume and exists:
+            self._load(header)
+        elif exists and not readonly:
+            raise ValueError(f"Journal {path} già presente: usa RESUME=true oppure rimuovilo")
+
+        if not readonly:
+            if resume and exists:
+                self._trim_partial()
+            self.file = open(path, "a" if resume and exists else "w", encoding="utf-8")
+            if not (resume and exists):
+                self._write(header)
+
+    def _load(self, header: dict):
+        with open(self.path, encoding="utf-8") as f:
+            saved = json.loads(f.readline())
+            if saved != header:
+                raise ValueError(f"Journal {self.path} creato con parametri diversi: {saved}")
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # riga troncata da un crash
+                state = rec[0]
+                if state == self.PLANNED:
+                    self.keys[rec[1]] = [rec[2], rec[3], state]
+                    self.destinations.add(rec[2])
+                elif state == self.PLAN_DONE:
+                    self.plan_complete = True
+                elif rec[1] in self.keys:
+                    self.keys[rec[1]][2] = state
+
+    def _trim_partial(self, block: int = 64 * 1024):
+        """Tronca il journal dopo l'ultimo a capo, così il primo record in append non finisce su una riga troncata."""
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - block)
+                f.seek(start)
+                i = f.read(pos - start).rfind(b"\n")
+                if i >= 0:
+                    pos = start + i + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def _write(self, rec):
+        self.file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def record(self, *rec):
+        if self.file:
+            with self.lock:
+                self._write(list(rec))
+
+    def planned(self, old_key: str, new_key: str, size: int):
+        self.record(self.PLANNED, old_key, new_key, size)
+
+    def copied(self, old_key: str):
+        self.record(self.COPIED, old_key)
+
+    def deleted(self, keys):
+        if self.file:
+            with self.lock:
+                for k in keys:
+                    self._write([self.DELETED, k])
+
+    def plan_done(self):
+        self.record(self.PLAN_DONE)
+        self.sync()
+
+    def sync(self):
+        if self.file:
+            with self.lock:
+                self._sync()
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def saved(self, old_key: str):
+        """[new_key, size, stato] registrato nel run precedente, o None."""
+        return self.keys.get(old_key)
+
+    def unfinished(self):
+        """Chiavi del run precedente non ancora cancellate: (old_key, new_key, size, già copiata)."""
+        for old_key, (new_key, size, state) in self.keys.items():
+            if state != self.DELETED:
+                yield old_key, new_key, size, state == self.COPIED
+
+
+class DeleteBatcher:
+    """
+    Cancella le sorgenti già copiate con delete_objects, a blocchi di
+    DELETE_BATCH_SIZE chiavi, da un thread dedicato e da un piccolo pool.
+    Gli errori per chiave della risposta vengono stampati come per delete_object.
+    """
+
+    _STOP = object()
+
+    def __init__(self, bucket: str, batch_size: int = DELETE_BATCH_SIZE,
+                 workers: int = DELETE_WORKERS, max_wait: float = DELETE_MAX_WAIT,
+                 journal: RenameJournal | None = None,
+                 limiter: AdaptiveConcurrency | None = None):
+        self.bucket = bucket
+        self.journal = journal
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=batch_size * workers * 2)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.lock = threading.Lock()
+        self.deleted = 0
+        self.failed = 0
+        self.requests = 0
+        self.thread = threading.Thread(target=self._run, name="delete-batcher", daemon=True)
+        self.thread.start()
+
+    def add(self, key: str):
+        self.queue.put(key)
+
+    def close(self):
+        """Invia l'ultimo batch e attende la fine di tutte le delete."""
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def _submit(self, keys: list):
+        self.slots.acquire()
+        self.pool.submit(self._delete, keys).add_done_callback(partial(self._finished, keys))
+
+    def _finished(self, keys: list, fut):
+        self.slots.release()
+        e = fut.exception()
+        if e is not None:
+            # errore inatteso in _delete: il batch non va perso in silenzio
+            print(f"ERRORE delete batch di {len(keys)} chiavi da {keys[0]}: {e}")
+            with self.lock:
+                self.failed += len(keys)
+
+    def _run(self):
+        batch = []
+        while True:
+            try:
+                key = self.queue.get(timeout=self.max_wait)
+            except queue.Empty:
+                key = None
+            if key is self._STOP:
+                break
+            if key is not None:
+                batch.append(key)
+            if batch and (len(batch) >= self.batch_size or key is None):
+                self._submit(batch)
+                batch = []
+        if batch:
+            self._submit(batch)
+
+    def _delete_batch(self, keys: list):
+        with aws_metrics.phase("delete"):
+            resp = s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+            )
+        with self.lock:
+            self.requests += 1
+        return resp.get("Errors", [])
+
+    def _delete(self, keys: list):
+        if self.journal:
+            self.journal.sync()  # le copie di questo batch devono essere già su disco
+        prefix = throttle_prefix(keys[0])
+        try:
+            if self.limiter:
+                errors = self.limiter.call(prefix, self._delete_batch, keys)
+                # le singole chiavi in SlowDown vengono ritentate, non perse
+                for _ in range(MAX_RETRIES):
+                    throttled = {err["Key"] for err in errors if err.get("Code") in THROTTLE_CODES}
+                    if not throttled:
+                        break
+                    self.limiter.on_throttle(prefix)
+                    errors = [err for err in errors if err["Key"] not in throttled]
+                    errors += self.limiter.call(prefix, self._delete_batch, sorted(throttled))
+            else:
+                errors = self._delete_batch(keys)
+        except (ClientError, BotoCoreError) as e:
+            for k in keys:
+                print(f"ERRORE delete {k}: {e}")
+            with self.lock:
+                self.requests += 1
+                self.failed += len(keys)
+            return
+
+        for err in errors:
+            print(f"ERRORE delete {err.get('Key')}: {err.get('Code')} {err.get('Message')}")
+        if self.journal:
+            failed = {err.get("Key") for err in errors}
+            self.journal.deleted(k for k in keys if k not in failed)
+        with self.lock:
+            self.deleted += len(keys) - len(errors)
+            self.failed += len(errors)
+
+
+def copy_multipart(bucket: str, old_key: str, new_key: str, size: int,
+                   part_size: int, pool: ThreadPoolExecutor,
+                   limiter: AdaptiveConcurrency | None = None):
+    """
+    Copia lato server con create_multipart_upload + upload_part_copy in parallelo
+    sul pool, mantenendo metadata, header e tag come MetadataDirective="COPY".
+    Ogni parte richiede che la sorgente abbia ancora lo stesso ETag.
+    In caso di errore l'upload viene annullato e l'eccezione rilanciata.
+    """
+    head = s3.head_object(Bucket=bucket, Key=old_key)
+    tags = s3.get_object_tagging(Bucket=bucket, Key=old_key).get("TagSet", [])
+
+    extra = {h: head[h] for h in COPIED_HEADERS if head.get(h)}
+    if tags:
+        extra["Tagging"] = urlencode([(t["Key"], t["Value"]) for t in tags])
+
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket, Key=new_key, Metadata=head.get("Metadata", {}), **extra
+    )["UploadId"]
+
+    part_size = max(part_size, -(-size // MULTIPART_MAX_PARTS))
+    copy_source = {"Bucket": bucket, "Key": old_key}
+
+    call = partial(limiter.call, throttle_prefix(new_key)) if limiter else (lambda fn, **kw: fn(**kw))
+
+    def _copy_part(number: int, start: int):
+        end = min(start + part_size, size) - 1
+        resp = call(
+            s3.upload_part_copy,
+            Bucket=bucket,
+            Key=new_key,
+            UploadId=upload_id,
+            PartNumber=number,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+            CopySourceIfMatch=head["ETag"],
+        )
+        return {"PartNumber": number, "ETag": resp["CopyPartResult"]["ETag"]}
+
+    futures = []
+    try:
+        for n, start in enumerate(range(0, size, part_size), 1):
+            futures.append(pool.submit(_copy_part, n, start))
+        parts = [f.result() for f in futures]
+        s3.complete_multipart_upload(
+            Bucket=bucket, Key=new_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        for f in futures:
+            f.cancel()
+        try:
+            s3.abort_multipart_upload(Bucket=bucket, Key=new_key, UploadId=upload_id)
+        except ClientError as e:
+            print(f"ERRORE abort multipart {new_key} ({upload_id}): {e}")
+        raise
+
+
 def rename_segment(
     bucket: str,
-    old_segment: str,
-    new_segment: str,
+    old_segment: str | None,
+    new_segment: str | None,
     search_prefix: str | None = None,
     dry_run: bool = True,
     max_workers: int = 16,
     allow_collisions: bool = False,
+    multipart_threshold: int = MULTIPART_THRESHOLD,
+    part_size: int = MULTIPART_PART_SIZE,
+    journal_path: str | None = None,
+    resume: bool = False,
+    rules: list[tuple[str, str]] | SegmentRules | None = None,
+    metrics_interval: float = 0,
+    metrics_out: str | None = None,
 ):
     """
     Rinomina tutte le chiavi S3 che contengono `old_segment` sostituendolo con `new_segment`,
     ovunque nel path. Esegue COPY poi DELETE.
+    Con `rules` applica più sostituzioni nello stesso listing (vedi SegmentRules).
 
     bucket: nome bucket
     old_segment: es. '/old/'  (includere le '/' se vuoi match di cartella)
@@ -34,102 +703,239 @@ def rename_segment(
     dry_run: True = stampa piano operativo senza toccare nulla
     max_workers: numero thread di lavoro
     allow_collisions: False = salta casi in cui più chiavi convergono sulla stessa destinazione
+    multipart_threshold: byte oltre i quali la copia usa upload_part_copy in parallelo
+    part_size: dimensione delle parti per la copia multipart
+    journal_path: file JSONL in cui registrare lo stato di ogni chiave (None = nessun journal)
+    resume: True = riprende dal journal: salta il completato, finisce le delete delle
+            chiavi già copiate e, se il piano era completo, non rilista il bucket
+    rules: lista di coppie (old_segment, new_segment) (o SegmentRules già costruito) al posto della singola coppia
+    metrics_interval: secondi tra due righe di avanzamento delle metriche (0 = nessuna)
+    metrics_out: file per lo snapshot finale delle metriche (.json o testo Prometheus)
     """
 
     if not bucket:
         raise ValueError("BUCKET mancante")
-    if not old_segment:
-        raise ValueError("OLD_SEGMENT mancante")
-    if new_segment is None:
-        raise ValueError("NEW_SEGMENT mancante")
-    if old_segment == new_segment:
-        print("Nessuna modifica: OLD_SEGMENT == NEW_SEGMENT")
+    metrics = aws_metrics.enable() if metrics_interval > 0 or metrics_out else None
+    # Pool di connessioni per worker di copia + parti multipart + batch di delete
+    aws_clients.get_client("s3", max_workers=max_workers + PART_WORKERS + DELETE_WORKERS, **S3_CLIENT_OPTIONS)
+    if rules is None:
+        if not old_segment:
+            raise ValueError("OLD_SEGMENT mancante")
+        if new_segment is None:
+            raise ValueError("NEW_SEGMENT mancante")
+        if old_segment == new_segment:
+            print("Nessuna modifica: OLD_SEGMENT == NEW_SEGMENT")
+            return
+        # coppia singola da env: stessa semantica di str.replace, niente '/' condivise
+        rules = SegmentRules([(old_segment, new_segment)], share_slash=False)
+
+    segment_rules = rules if isinstance(rules, SegmentRules) else SegmentRules(rules)
+    if not segment_rules:
+        print("Nessuna regola da applicare")
         return
-
-    paginator = s3.get_paginator("list_objects_v2")
-    pages = paginator.paginate(Bucket=bucket, Prefix=search_prefix or "")
-
-    ops = []  # (old_key, new_key, size_bytes)
-    for page in pages:
-        for obj in page.get("Contents", []):
-            old_key = obj["Key"]
-
-            if old_segment not in old_key:
+    if len(segment_rules) > 1:
+        print(f"Regole: {len(segment_rules)} sostituzioni in un unico listing")
+    if resume and not journal_path:
+        raise ValueError("RESUME richiede JOURNAL_PATH")
+
+    journal = None
+    if journal_path:
+        header = {"bucket": bucket, "rules": [list(r) for r in segment_rules.rules],
+                  "search_prefix": search_prefix or "", "allow_collisions": allow_collisions}
+        journal = RenameJournal(journal_path, header, resume, readonly=dry_run)
+        if resume:
+            print(f"Ripresa da {journal_path}: {len(journal.keys)} chiavi nel journal, "
+                  f"piano {'completo' if journal.plan_complete else 'incompleto (rilisto il bucket)'}")
+
+    own = OwnDestinations(segment_rules, search_prefix)
+    plan = iter_plan(bucket, segment_rules, search_prefix, own)
+    collisions = 0
+    planned = 0
+
+    def iter_ops(spill_dir: str):
+        """
+        Operazioni da eseguire, in streaming: il listing alimenta direttamente i
+        worker. Con ALLOW_COLLISIONS=False passano subito solo le destinazioni
+        che hanno una sola sorgente possibile (SegmentRules.single_source, il
+        caso di una cartella rinominata); per le altre una collisione si può
+        riconoscere solo a listing finito, quindi vanno nei run ordinati per
+        destinazione su disco e le destinazioni duplicate vengono saltate.
+        """
+        nonlocal collisions, planned
+        runs = DestinationRuns(spill_dir)
+        for op in plan:
+            if allow_collisions or segment_rules.single_source(op[1]):
+                planned += 1
+                own.add(op[0], op[1])
+                yield op
+            else:
+                runs.add(op)
+
+        warned = False
+        for new_key, group in runs.groups():
+            if len(group) > 1:
+                if not warned:
+                    print("[ATTENZIONE] Collisioni rilevate. Verranno SALTATE con ALLOW_COLLISIONS=False")
+                    warned = True
+                collisions += 1
+                print(f"  DEST: {new_key}")
+                for ok, _, _ in group:
+                    print(f"    SRC: {ok}")
                 continue
-
-            new_key = old_key.replace(old_segment, new_segment)
-
-            if new_key == old_key:
+            planned += 1
+            yield group[0]
+
+    def iter_work(spill_dir: str):
+        """
+        Lavoro da fare: (old_key, new_key, size, già copiata).
+        In ripresa con piano completo legge solo il journal, altrimenti usa il
+        listing saltando le chiavi già cancellate e le destinazioni del run precedente.
+        """
+        nonlocal planned
+        if journal and journal.plan_complete:
+            for work in journal.unfinished():
+                planned += 1
+                yield work
+            return
+
+        for old_key, new_key, size in iter_ops(spill_dir):
+            prev = journal.saved(old_key) if journal else None
+            if prev:
+                if prev[2] != RenameJournal.DELETED:
+                    yield old_key, prev[0], prev[1], prev[2] == RenameJournal.COPIED
                 continue
+            if journal and old_key in journal.destinations:
+                planned -= 1  # è il risultato di una rinomina già fatta
+                continue
+            if journal:
+                journal.planned(old_key, new_key, size)
+            yield old_key, new_key, size, False
 
-            ops.append((old_key, new_key, obj.get("Size", 0)))
-
-    if not ops:
-        print("Nessun oggetto da rinominare")
-        return
-
-    # Collision detection: più sorgenti -> stessa destinazione
-    counts = Counter(nk for _, nk, _ in ops)
-    collisions = {nk for nk, c in counts.items() if c > 1}
-
-    if collisions and not allow_collisions:
-        by_dest = defaultdict(list)
-        for ok, nk, _ in ops:
-            if nk in collisions:
-                by_dest[nk].append(ok)
-
-        print("[ATTENZIONE] Collisioni rilevate. Verranno SALTATE con ALLOW_COLLISIONS=False")
-        for nk, oks in by_dest.items():
-            print(f"  DEST: {nk}")
-            for ok in oks:
-                print(f"    SRC: {ok}")
-
-        # filtra fuori le collisioni
-        ops = [t for t in ops if t[1] not in collisions]
-
-    if dry_run:
-        for old_key, new_key, _ in ops:
-            print(f"[DRY RUN] COPY {old_key} -> {new_key}")
-            print(f"[DRY RUN] DELETE {old_key}")
-        print(f"Piano: {len(ops)} oggetti. Collisioni: {len(collisions)}")
-        return
+        if journal:
+            journal.plan_done()
 
     moved = 0
     bytes_copied = 0
+    delete_only = 0
+    lock = threading.Lock()
+
+    limiter = AdaptiveConcurrency(max_workers)
 
     def _move_one(old_key: str, new_key: str, size: int):
         copy_source = {"Bucket": bucket, "Key": old_key}
 
+        limiter.acquire()
+        latency = None
         try:
-            s3.copy_object(
-                Bucket=bucket,
-                Key=new_key,
-                CopySource=copy_source,
-                MetadataDirective="COPY",  # preserva metadata e tag
-            )
+            started = time.monotonic()
+            with aws_metrics.phase("copia"):
+                if size >= multipart_threshold:
+                    copy_multipart(bucket, old_key, new_key, size, part_size, part_pool, limiter)
+                else:
+                    limiter.call(
+                        throttle_prefix(new_key),
+                        s3.copy_object,
+                        Bucket=bucket,
+                        Key=new_key,
+                        CopySource=copy_source,
+                        MetadataDirective="COPY",  # preserva metadata e tag
+                    )
+                    latency = (time.monotonic() - started) / (1 + size / LATENCY_SIZE_UNIT)
         except ClientError as e:
             print(f"ERRORE copia {old_key} -> {new_key}: {e}")
             return 0, 0
+        finally:
+            limiter.release(latency)
 
-        try:
-            s3.delete_object(Bucket=bucket, Key=old_key)
-        except ClientError as e:
-            print(f"ERRORE delete {old_key}: {e}")
-            # a questo punto vecchio e nuovo coesistono
-
+        if journal:
+            journal.copied(old_key)
+        # la delete avviene a blocchi: se fallisce vecchio e nuovo coesistono
+        deleter.add(old_key)
         return 1, size
 
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        futures = [pool.submit(_move_one, ok, nk, sz) for ok, nk, sz in ops]
-        for fut in as_completed(futures):
+    # Coda limitata: al massimo QUEUE_PER_WORKER operazioni per worker in attesa,
+    # poi il listing si ferma finché un worker non si libera
+    slots = threading.BoundedSemaphore(max_workers * QUEUE_PER_WORKER)
+
+    def _done(fut):
+        nonlocal moved, bytes_copied
+        try:
             m, b = fut.result()
-            moved += m
-            bytes_copied += b
+            with lock:
+                moved += m
+                bytes_copied += b
+        except Exception as e:
+            print(f"ERRORE inatteso: {e}")
+        finally:
+            slots.release()
+
+    with tempfile.TemporaryDirectory(prefix="rename_segment_") as spill_dir:
+        if dry_run:
+            for old_key, new_key, _, copied in iter_work(spill_dir):
+                if not copied:
+                    print(f"[DRY RUN] COPY {old_key} -> {new_key}")
+                print(f"[DRY RUN] DELETE {old_key}")
+            if planned or collisions:
+                print(f"Piano: {planned} oggetti. Collisioni: {collisions}")
+            else:
+                print("Nessun oggetto da rinominare")
+            if metrics and metrics_out:
+                metrics.write(metrics_out)
+            return
+
+        deleter = DeleteBatcher(bucket, journal=journal, limiter=limiter)
+        # pool condiviso per le parti delle copie multipart
+        part_pool = ThreadPoolExecutor(max_workers=PART_WORKERS, thread_name_prefix="part-copy")
+        stop_reporter = None
+        if metrics and metrics_interval > 0:
+            stop_reporter = metrics.start_reporter(
+                metrics_interval,
+                lambda: f"pianificati {planned}, spostati {moved}, cancellati {deleter.deleted}, "
+                        f"concorrenza {int(limiter.limit)}")
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                # "piano": attesa del listing / dei run ordinati; "attesa_worker": coda piena
+                for ok, nk, sz, copied in aws_metrics.timed_iter("piano", iter_work(spill_dir)):
+                    if copied:
+                        # copia fatta nel run precedente: manca solo la delete
+                        delete_only += 1
+                        deleter.add(ok)
+                        continue
+                    with aws_metrics.phase("attesa_worker"):
+                        slots.acquire()
+                    pool.submit(_move_one, ok, nk, sz).add_done_callback(_done)
+        finally:
+            part_pool.shutdown(wait=True)
+            deleter.close()
+            if journal:
+                journal.close()
+            if stop_reporter:
+                stop_reporter()
+            if metrics and metrics_out:
+                metrics.write(metrics_out)
+
+    if not planned and not collisions:
+        print("Nessun oggetto da rinominare")
+        return
 
     print(f"Oggetti spostati: {moved}")
     print(f"Byte copiati: {bytes_copied}")
+    if delete_only:
+        print(f"Copie già fatte nel run precedente (solo delete): {delete_only}")
+    print(f"Sorgenti cancellate: {deleter.deleted} in {deleter.requests} richieste DeleteObjects")
+    if deleter.failed:
+        print(f"Delete fallite: {deleter.failed} (vecchia e nuova chiave coesistono)")
     if collisions and not allow_collisions:
-        print(f"Saltate collisioni: {len(collisions)} destinazioni")
+        print(f"Saltate collisioni: {collisions} destinazioni")
+    print(f"Concorrenza: attuale {int(limiter.limit)}, picco {limiter.peak} (massimo {max_workers})")
+    if limiter.throttled:
+        print(f"Throttling: {limiter.throttled} risposte, {limiter.retries} retry")
+    if metrics:
+        print("Metriche API:")
+        for line in metrics.summary_lines():
+            print(line)
+        if metrics_out:
+            print(f"Snapshot metriche: {metrics_out}")
 
 
 def env_or_none(name: str):
@@ -155,6 +961,15 @@ if __name__ == "__main__":
     except ValueError:
         max_workers = 16
 
+    def env_mb(name: str, default: int) -> int:
+        v = os.getenv(name)
+        try:
+            return int(float(v) * 1024 * 1024) if v else default
+        except ValueError:
+            return default
+
+    rules_file = env_or_none("RULES_FILE")
+
     rename_segment(
         bucket=bucket,
         old_segment=old_segment,
@@ -163,4 +978,11 @@ if __name__ == "__main__":
         dry_run=dry_run,
         max_workers=max_workers,
         allow_collisions=allow_collisions,
+        multipart_threshold=env_mb("MULTIPART_THRESHOLD_MB", MULTIPART_THRESHOLD),
+        part_size=env_mb("PART_SIZE_MB", MULTIPART_PART_SIZE),
+        journal_path=env_or_none("JOURNAL_PATH"),
+        resume=str_to_bool(os.getenv("RESUME"), default=False),
+        rules=SegmentRules.from_file(rules_file) if rules_file else None,
+        metrics_interval=float(os.getenv("METRICS_INTERVAL") or 0),
+        metrics_out=env_or_none("METRICS_OUT"),
     )
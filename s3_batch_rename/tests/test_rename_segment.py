@@ -0,0 +1,111 @@
+"""Test di rename_segment contro S3 simulato da moto (pip install moto pytest)."""
+import os
+import sys
+import threading
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import rename_segment as rs  # noqa: E402
+from rename_segment import aws_clients  # noqa: E402  (common/ aggiunto al path da rename_segment)
+
+BUCKET = "rename-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in (("AWS_ACCESS_KEY_ID", "test"), ("AWS_SECRET_ACCESS_KEY", "test"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    with moto.mock_aws():
+        aws_clients._clients.clear()  # client creati dentro il mock
+        client = aws_clients.get_client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    aws_clients._clients.clear()
+
+
+def all_keys(client):
+    keys = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET):
+        keys += [o["Key"] for o in page.get("Contents", [])]
+    return keys
+
+
+def test_single_source():
+    rules = rs.SegmentRules([("/2023/", "/archive/2023/"), ("/tmp/", "/staging/")])
+    assert rules.single_source("x/archive/2023/f")
+    assert not rules.single_source("x/archive/2023/archive/2023/f")
+    assert not rules.single_source("x/archive/2023/staging/f")
+    assert not rules.single_source("x/f")
+    # due regole con lo stesso nuovo segmento: la sorgente non è unica
+    assert not rs.SegmentRules([("/a/", "/c/"), ("/b/", "/c/")]).single_source("x/c/f")
+
+
+def test_own_destinations_skips_only_pending_keys():
+    own = rs.OwnDestinations(rs.SegmentRules([("/2023/", "/archive/2023/")]), "x/")
+    own.add("x/2023/a", "x/archive/2023/a")
+    own.add("x/2023/b", "y/archive/2023/b")  # fuori dal prefisso listato
+    assert not own.seen("x/2023/b")
+    assert own.seen("x/archive/2023/a")
+    assert not own.seen("x/archive/2023/a")
+
+
+@pytest.mark.parametrize("allow_collisions", [True, False])
+def test_self_containing_rule_does_not_cascade(s3, allow_collisions):
+    # più pagine di listing: le copie atterrano mentre il listing è ancora in corso
+    names = [f"f{i:05d}.txt" for i in range(1500)]
+    for name in names:
+        s3.put_object(Bucket=BUCKET, Key=f"x/2023/{name}", Body=b"x")
+
+    # senza protezione la rinomina va avanti all'infinito (x/archive/archive/.../2023/)
+    run = threading.Thread(target=rs.rename_segment, daemon=True,
+                           args=(BUCKET, "/2023/", "/archive/2023/"),
+                           kwargs={"dry_run": False, "max_workers": 8,
+                                   "allow_collisions": allow_collisions})
+    run.start()
+    run.join(timeout=120)
+    assert not run.is_alive(), "rinomina a cascata delle destinazioni appena create"
+    assert all_keys(s3) == [f"x/archive/2023/{name}" for name in names]
+
+
+def test_collisions_are_skipped(s3):
+    for key in ("a/old/new/f", "a/new/old/f", "a/old/g"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+
+    rs.rename_segment(BUCKET, "/old/", "/new/", dry_run=False, max_workers=4)
+
+    assert all_keys(s3) == ["a/new/g", "a/new/old/f", "a/old/new/f"]
+
+
+def test_single_pair_keeps_str_replace_semantics():
+    legacy = rs.SegmentRules([("/tmp/", "/staging/")], share_slash=False)
+    shared = rs.SegmentRules([("/tmp/", "/staging/")])
+    for key in ("a/tmp/tmp/f", "a/tmp/x/tmp/tmp/f", "tmp/f", "a/tmp/"):
+        assert legacy.apply(key) == key.replace("/tmp/", "/staging/")
+    assert shared.apply("a/tmp/tmp/f") == "a/staging/staging/f"
+
+
+def test_env_pair_renames_like_str_replace(s3):
+    s3.put_object(Bucket=BUCKET, Key="a/tmp/tmp/f", Body=b"x")
+
+    rs.rename_segment(BUCKET, "/tmp/", "/staging/", dry_run=False, max_workers=2)
+
+    assert all_keys(s3) == ["a/staging/tmp/f"]
+
+
+def test_journal_resume_trims_truncated_line(tmp_path):
+    header = {"bucket": BUCKET}
+    path = tmp_path / "journal.jsonl"
+    path.write_text('{"bucket": "rename-test"}\n["P", "a/old/f", "a/new/f", 1]\n["C", "a/ol', encoding="utf-8")
+
+    journal = rs.RenameJournal(str(path), header, resume=True)
+    journal.copied("a/old/f")
+    journal.close()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines[-1] == '["C", "a/old/f"]'
+    assert rs.RenameJournal(str(path), header, resume=True, readonly=True).saved("a/old/f")[2] == "C"
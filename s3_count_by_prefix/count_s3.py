@@ -1,8 +1,17 @@
 #!/usr/bin/env python3
-import os, sys, re, json, argparse, datetime
+import os, sys, re, json, argparse, datetime, csv, gzip, threading
+from array import array
+from bisect import bisect_right
+from urllib.parse import unquote_plus
 from dotenv import load_dotenv
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+# Factory client condivisa (common/aws_clients.py; nel container è copiata accanto allo script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import aws_clients
+import aws_metrics
 
 # Flush immediato
 sys.stdout.reconfigure(line_buffering=True)
@@ -21,32 +30,551 @@ parser.add_argument("--prefix", default=S3_PREFIX_ENV, help="Prefisso, es: path/
 parser.add_argument("--suffix", default=S3_SUFFIX_ENV, help="Conta solo chiavi che finiscono con questo suffisso, es: .gz")
 parser.add_argument("--max-keys", type=int, default=1000, help="Dimensione pagina per list_objects_v2")
 parser.add_argument("--show-samples", type=int, default=0, help="Mostra N chiavi di esempio")
+parser.add_argument("--parallel", type=int, default=0, help="Worker per il listing parallelo a shard (0 = sequenziale)")
+parser.add_argument("--shard-depth", type=int, default=2, help="Livelli massimi di sotto-prefissi da esplorare con Delimiter")
+parser.add_argument("--max-shards", type=int, default=256, help="Soglia di shard oltre la quale si smette di espandere i sotto-prefissi")
+parser.add_argument("--inventory-manifest", default="", help="manifest.json locale di S3 Inventory: conta dai report invece che dalle API")
+parser.add_argument("--inventory-dir", default="", help="Cartella con i file dati dell'inventory (default: cartella del manifest)")
+parser.add_argument("--inventory-workers", type=int, default=os.cpu_count() or 1, help="Processi per decodificare i file dell'inventory")
+parser.add_argument("--depth", type=int, default=0, help="Dettaglio per sotto-prefisso fino a N livelli (0 = solo totali)")
+parser.add_argument("--tree-top", type=int, default=20, help="Sotto-prefissi mostrati per livello, ordinati per bytes (0 = tutti)")
+parser.add_argument("--tree-out", default="", help="Esporta l'albero dei prefissi in JSON o CSV (in base all'estensione)")
+parser.add_argument("--checkpoint", default="", help="File di stato (append-only) su cui salvare l'avanzamento per prefisso")
+parser.add_argument("--checkpoint-every", type=int, default=20, help="fsync del file di stato ogni N pagine")
+parser.add_argument("--resume", action="store_true", help="Riprende dal file --checkpoint con StartAfter sull'ultima chiave salvata")
+parser.add_argument("--metrics-interval", type=float, default=0, help="Secondi tra due righe di avanzamento con le metriche delle API (0 = nessuna)")
+parser.add_argument("--metrics-out", default="", help="Snapshot finale delle metriche: JSON o testo Prometheus (in base all'estensione)")
 args = parser.parse_args()
 
+manifest = None
+if args.inventory_manifest:
+    try:
+        with open(args.inventory_manifest, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Manifest inventory non leggibile: {e}")
+        sys.exit(2)
+    if not args.bucket:
+        args.bucket = manifest.get("sourceBucket", "")
+    elif manifest.get("sourceBucket") and manifest["sourceBucket"] != args.bucket:
+        print(f"⚠️ Il manifest si riferisce al bucket {manifest['sourceBucket']!r}, non a {args.bucket!r}")
+
 if not args.bucket:
     print("❌ Specifica --bucket o imposta S3_BUCKET nel .env")
     sys.exit(2)
 
+if args.resume and not args.checkpoint:
+    print("❌ --resume richiede --checkpoint")
+    sys.exit(2)
+if args.resume and args.depth > 0:
+    print("❌ --resume non è compatibile con --depth: l'albero dei prefissi non viene salvato nel checkpoint")
+    sys.exit(2)
+
 print("-" * 50)
 print(f"🌍 AWS_DEFAULT_REGION: {AWS_REGION}")
 print(f"🪣 Bucket: {args.bucket}")
 print(f"📂 Prefisso: '{args.prefix}'")
 print(f"🎯 Suffix: '{args.suffix}'")
+if manifest:
+    print(f"📦 Inventory: {args.inventory_manifest} ({manifest.get('fileFormat')}, {len(manifest.get('files', []))} file)")
+elif args.parallel > 0:
+    print(f"🧵 Parallelo: {args.parallel} worker, profondità shard {args.shard_depth}, max shard {args.max_shards}")
+if args.checkpoint and not manifest:
+    print(f"💾 Checkpoint: {args.checkpoint}{' (ripresa)' if args.resume else ''}")
 print("-" * 50)
 
-s3 = boto3.client("s3", region_name=AWS_REGION)
+# Hook delle metriche sui client: vanno attivati prima che il client venga creato
+metrics = aws_metrics.enable() if args.metrics_interval > 0 or args.metrics_out else None
+
+# Il pool di connessioni deve bastare per tutti i worker; il client nasce alla prima chiamata
+s3 = aws_clients.lazy_client("s3", region=AWS_REGION, max_workers=args.parallel)
+
+def iter_pages(bucket: str, prefix: str, max_keys: int, start_after: str = None):
+    """Itera le pagine di oggetti sotto prefix, opzionalmente a partire dopo start_after."""
+    paginator = s3.get_paginator("list_objects_v2")
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "PaginationConfig": {"PageSize": max_keys}}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    for page in paginator.paginate(**kwargs):
+        yield page.get("Contents", [])
 
 def iter_objects(bucket: str, prefix: str, max_keys: int):
     """Itera tutti gli oggetti sotto prefix usando la paginazione."""
-    paginator = s3.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": max_keys}):
-        for obj in page.get("Contents", []):
-            yield obj
+    for page in iter_pages(bucket, prefix, max_keys):
+        yield from page
 
 def is_file_key(key: str) -> bool:
     """Esclude 'directory markers' che terminano con '/'."""
     return not key.endswith("/")
 
+# Istogramma dimensioni: limiti superiori esclusivi delle classi
+SIZE_BOUNDS = [1, 1 << 10, 64 << 10, 1 << 20, 16 << 20, 128 << 20, 1 << 30]
+SIZE_LABELS = ["0 B", "<1 KiB", "<64 KiB", "<1 MiB", "<16 MiB", "<128 MiB", "<1 GiB", ">=1 GiB"]
+
+class PrefixTree:
+    """
+    Albero dei sotto-prefissi sotto root, fino a depth livelli separati da '/'.
+    I contatori stanno in array paralleli indicizzati per nodo, quindi la memoria
+    cresce con il numero di prefissi distinti e non con il numero di chiavi.
+    """
+
+    def __init__(self, root: str, depth: int):
+        self.root = root
+        self.depth = depth
+        self.names = [root]            # segmento del nodo (la radice ha il prefisso intero)
+        self.parent = array("l", [-1])
+        self.objects = array("q", [0])
+        self.bytes = array("q", [0])
+        self.hist = array("q", [0] * len(SIZE_LABELS))
+        self.children = {}             # (nodo padre, segmento) -> nodo
+
+    def _child(self, node: int, name: str) -> int:
+        child = self.children.get((node, name))
+        if child is None:
+            child = len(self.names)
+            self.children[(node, name)] = child
+            self.names.append(name)
+            self.parent.append(node)
+            self.objects.append(0)
+            self.bytes.append(0)
+            self.hist.extend([0] * len(SIZE_LABELS))
+        return child
+
+    def _bump(self, node: int, objects: int, size: int, hist):
+        self.objects[node] += objects
+        self.bytes[node] += size
+        base = node * len(SIZE_LABELS)
+        for i, n in enumerate(hist):
+            self.hist[base + i] += n
+
+    def add(self, key: str, size: int):
+        """Conta una chiave (già filtrata) sulla radice e su ogni cartella del suo path."""
+        slot = bisect_right(SIZE_BOUNDS, size)
+        width = len(SIZE_LABELS)
+        node = 0
+        self.objects[0] += 1
+        self.bytes[0] += size
+        self.hist[slot] += 1
+        # l'ultimo pezzo è il nome file (o il resto oltre depth): non è una cartella
+        for name in key[len(self.root):].split("/", self.depth)[:-1]:
+            node = self._child(node, name)
+            self.objects[node] += 1
+            self.bytes[node] += size
+            self.hist[node * width + slot] += 1
+
+    def merge(self, other: "PrefixTree"):
+        """Somma un albero costruito su un altro shard (stessa radice)."""
+        width = len(SIZE_LABELS)
+        mapping = [0]
+        for node in range(len(other.names)):
+            if node:
+                mapping.append(self._child(mapping[other.parent[node]], other.names[node]))
+            base = node * width
+            self._bump(mapping[node], other.objects[node], other.bytes[node], other.hist[base:base + width])
+
+    def rows(self, top: int = 0):
+        """
+        Visita in profondità: (prefisso, livello, oggetti, bytes, istogramma).
+        I figli sono ordinati per bytes decrescenti; top > 0 ne limita il numero.
+        """
+        kids = {}
+        for (parent, _), child in self.children.items():
+            kids.setdefault(parent, []).append(child)
+
+        width = len(SIZE_LABELS)
+        stack = [(0, self.root, 0)]
+        while stack:
+            node, path, level = stack.pop()
+            yield path, level, self.objects[node], self.bytes[node], list(self.hist[node * width:(node + 1) * width])
+            children = sorted(kids.get(node, []), key=lambda c: self.bytes[c], reverse=True)
+            if top:
+                children = children[:top]
+            for child in reversed(children):
+                stack.append((child, f"{path}{self.names[child]}/", level + 1))
+
+    def to_dict(self):
+        """Struttura annidata per l'export JSON."""
+        nodes = []
+        for path, level, objects, size, hist in self.rows():
+            item = {"prefix": path, "objects": objects, "bytes": size,
+                    "histogram": dict(zip(SIZE_LABELS, hist)), "children": []}
+            del nodes[level:]
+            if nodes:
+                nodes[-1]["children"].append(item)
+            nodes.append(item)
+        return nodes[0]
+
+def print_tree(tree: PrefixTree, top: int):
+    """Stampa il dettaglio per livello (la radice è già nel totale del prefisso)."""
+    for path, level, objects, size, hist in tree.rows(top):
+        if level == 0:
+            continue
+        busiest = max(range(len(hist)), key=hist.__getitem__)
+        print(f"  {'  ' * level}{path}  {objects} oggetti, {size} bytes (più frequenti: {SIZE_LABELS[busiest]})")
+
+def export_trees(trees, path: str):
+    """Esporta gli alberi dei prefissi in CSV (estensione .csv) o JSON."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            writer = csv.writer(f)
+            writer.writerow(["prefix", "depth", "objects", "bytes"] + SIZE_LABELS)
+            for tree in trees:
+                for prefix, level, objects, size, hist in tree.rows():
+                    writer.writerow([prefix, level, objects, size] + hist)
+        else:
+            json.dump([tree.to_dict() for tree in trees], f, indent=2, ensure_ascii=False)
+
+def count_objects(objects, suffix: str, max_samples: int, tree: PrefixTree = None):
+    """
+    Applica i filtri (directory marker, suffix) e conta.
+    Restituisce (oggetti, bytes, esempi) con al massimo max_samples esempi.
+    Se tree è indicato, ogni chiave contata viene aggiunta anche all'albero.
+    """
+    count = 0
+    size_sum = 0
+    samples = []
+    for obj in objects:
+        key = obj["Key"]
+        if not is_file_key(key):
+            continue
+        if suffix and not key.endswith(suffix):
+            continue
+        size = obj.get("Size", 0)
+        count += 1
+        size_sum += size
+        if tree is not None:
+            tree.add(key, size)
+        if len(samples) < max_samples:
+            samples.append(key)
+    return count, size_sum, samples
+
+class Checkpoint:
+    """
+    Stato di avanzamento su file JSONL append-only: un record per pagina con
+    ultima chiave e totali parziali di ogni unità di listing (prefisso o shard).
+    Le scritture restano nel buffer e il file viene sincronizzato con fsync
+    solo ogni `fsync_every` record, così il loop di listing non rallenta.
+    """
+
+    def __init__(self, path: str, fsync_every: int, resume: bool):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.state = self.load(path) if resume else {}
+        self.lock = threading.Lock()
+        self.pending = 0
+        if resume:
+            self.trim_partial(path)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+        header = {"bucket": args.bucket, "suffix": args.suffix}
+        saved = self.state.pop(None, None)
+        if saved and {k: saved.get(k) for k in header} != header:
+            raise ValueError(f"checkpoint {path!r} creato con parametri diversi: {saved}")
+        if not saved:
+            self._write(header)
+
+    @staticmethod
+    def load(path: str):
+        """Ultimo record per unità; una riga troncata da un crash viene ignorata."""
+        state = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    unit = (rec["prefix"], rec.get("shard")) if "prefix" in rec else None
+                    state[unit] = rec
+        except FileNotFoundError:
+            pass
+        return state
+
+    @staticmethod
+    def trim_partial(path: str, block: int = 64 * 1024):
+        """
+        Tronca il file dopo l'ultimo a capo: una riga troncata da un crash non
+        deve restare attaccata al primo record scritto in append.
+        """
+        try:
+            f = open(path, "rb+")
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - block)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                i = chunk.rfind(b"\n")
+                if i >= 0:
+                    pos = start + i + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def _write(self, rec):
+        self.file.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def save(self, unit, last_key, tally, done: bool = False):
+        prefix, shard = unit
+        count, size_sum, samples = tally
+        with self.lock:
+            self._write({"prefix": prefix, "shard": shard, "last_key": last_key, "objects": count,
+                         "bytes": size_sum, "samples": samples, "done": done})
+
+    def saved(self, unit):
+        return self.state.get(unit)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.file.close()
+
+checkpoint = None
+
+def count_listing(bucket: str, prefix: str, tree: "PrefixTree" = None, unit=None):
+    """
+    Lista e conta tutto prefix pagina per pagina.
+    Con --checkpoint salva ultima chiave e totali parziali di `unit` dopo ogni
+    pagina; se lo stato salvato esiste riparte con StartAfter dall'ultima chiave.
+    """
+    unit = unit or (prefix, None)
+    saved = checkpoint.saved(unit) if checkpoint else None
+    if saved and saved["done"]:
+        return saved["objects"], saved["bytes"], saved["samples"]
+
+    count, size_sum, samples = (saved["objects"], saved["bytes"], saved["samples"]) if saved else (0, 0, [])
+    last_key = saved["last_key"] if saved else None
+
+    for page in aws_metrics.timed_iter("listing", iter_pages(bucket, prefix, args.max_keys, last_key)):
+        with aws_metrics.phase("conteggio"):
+            c, b, found = count_objects(page, args.suffix, args.show_samples - len(samples), tree)
+        count += c
+        size_sum += b
+        samples.extend(found)
+        if checkpoint and page:
+            last_key = page[-1]["Key"]
+            with aws_metrics.phase("checkpoint"):
+                checkpoint.save(unit, last_key, (count, size_sum, samples))
+
+    if checkpoint:
+        checkpoint.save(unit, last_key, (count, size_sum, samples), done=True)
+    return count, size_sum, samples
+
+def new_tree(prefix: str):
+    """Albero dei prefissi se --depth è attivo, altrimenti None."""
+    return PrefixTree(prefix, args.depth) if args.depth > 0 else None
+
+def expand_prefix(bucket: str, prefix: str, max_keys: int, tree: PrefixTree = None):
+    """
+    Lista un solo livello sotto prefix con Delimiter='/'.
+    Restituisce (sotto-prefissi, conteggio degli oggetti diretti): gli oggetti
+    diretti non ricadono in nessun sotto-prefisso, quindi vanno contati qui.
+    """
+    sub_prefixes = []
+
+    def direct_objects():
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/",
+                                       PaginationConfig={"PageSize": max_keys}):
+            sub_prefixes.extend(cp["Prefix"] for cp in page.get("CommonPrefixes", []))
+            yield from page.get("Contents", [])
+
+    tally = count_objects(direct_objects(), args.suffix, args.show_samples, tree)
+    return sub_prefixes, tally
+
+def merge_tallies(tallies, max_samples: int):
+    """
+    Somma i conteggi (oggetti, bytes, esempi) di più shard.
+    Gli esempi vengono ordinati come li restituirebbe il listing sequenziale.
+    """
+    count = 0
+    size_sum = 0
+    samples = []
+    for c, b, found in tallies:
+        count += c
+        size_sum += b
+        samples.extend(found)
+    return count, size_sum, sorted(samples)[:max_samples]
+
+def count_prefix_parallel(pool: ThreadPoolExecutor, bucket: str, prefix: str, tree: PrefixTree = None):
+    """
+    Conta prefix dividendolo in shard: esplora i sotto-prefissi con Delimiter
+    fino a --shard-depth livelli (o finché si superano --max-shards shard),
+    poi lista gli shard in parallelo sul pool. I totali coincidono con il
+    listing sequenziale perché oggetti diretti e shard partizionano il prefisso.
+    Ogni shard costruisce il proprio albero, poi unito in tree.
+    """
+    frontier = [prefix]
+    tallies = []
+
+    def expand(p: str):
+        shard_tree = new_tree(prefix)
+        with aws_metrics.phase("espansione"):
+            return expand_prefix(bucket, p, args.max_keys, shard_tree), shard_tree
+
+    def count_shard(shard: str):
+        shard_tree = new_tree(prefix)
+        tally = count_listing(bucket, shard, shard_tree, unit=(prefix, shard))
+        return tally, shard_tree
+
+    for _ in range(args.shard_depth):
+        if len(frontier) >= args.max_shards:
+            break
+        next_frontier = []
+        for (sub_prefixes, tally), shard_tree in pool.map(expand, frontier):
+            next_frontier.extend(sub_prefixes)
+            tallies.append(tally)
+            if tree is not None:
+                tree.merge(shard_tree)
+        frontier = next_frontier
+        if not frontier:
+            break
+
+    print(f"  ↳ {len(frontier)} shard su {args.parallel} worker")
+
+    for tally, shard_tree in pool.map(count_shard, frontier):
+        tallies.append(tally)
+        if tree is not None:
+            tree.merge(shard_tree)
+    return merge_tallies(tallies, args.show_samples)
+
+def inventory_columns(file_schema: str):
+    """
+    Ricava i nomi di colonna dal fileSchema del manifest.
+    CSV: 'Bucket, Key, Size, ...'; Parquet/ORC: schema con campi come 'key', 'size', 'is_latest'.
+    """
+    if "{" in file_schema or "<" in file_schema:
+        return [c.lower() for c in re.findall(r"(\w+)\s*(?:\(|:|;)", file_schema)]
+    return [c.strip().lower() for c in file_schema.split(",")]
+
+def iter_inventory_rows(path: str, file_format: str, columns, batch_rows: int = 65536):
+    """
+    Legge un file dati dell'inventory a blocchi e produce (key, size, is_current).
+    is_current è False per versioni non correnti e delete marker, che list_objects_v2 non restituisce.
+    """
+    file_format = file_format.upper()
+
+    if file_format == "CSV":
+        def col(name):
+            return columns.index(name) if name in columns else None
+
+        i_key, i_size = col("key"), col("size")
+        i_latest, i_marker = col("islatest"), col("isdeletemarker")
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+            for row in csv.reader(f):
+                current = (i_latest is None or row[i_latest].lower() == "true") and \
+                          (i_marker is None or row[i_marker].lower() != "true")
+                size = row[i_size] if i_size is not None else ""
+                # Nei CSV le chiavi sono URL-encoded
+                yield unquote_plus(row[i_key]), int(size or 0), current
+        return
+
+    try:
+        import pyarrow.parquet as pq
+        import pyarrow.orc as orc
+    except ImportError:
+        raise ValueError(f"Formato {file_format} richiede pyarrow (pip install pyarrow)")
+
+    if file_format == "PARQUET":
+        pf = pq.ParquetFile(path)
+        names = pf.schema_arrow.names
+        wanted = [c for c in ("key", "size", "is_latest", "is_delete_marker") if c in names]
+        batches = pf.iter_batches(batch_size=batch_rows, columns=wanted)
+    elif file_format == "ORC":
+        of = orc.ORCFile(path)
+        names = of.schema.names
+        wanted = [c for c in ("key", "size", "is_latest", "is_delete_marker") if c in names]
+        batches = (of.read_stripe(i, columns=wanted) for i in range(of.nstripes))
+    else:
+        raise ValueError(f"Formato inventory non supportato: {file_format}")
+
+    for batch in batches:
+        n = batch.num_rows
+        data = {c: batch.column(batch.schema.get_field_index(c)).to_pylist() for c in wanted}
+        keys = data["key"]
+        sizes = data.get("size", [0] * n)
+        latest = data.get("is_latest", [True] * n)
+        markers = data.get("is_delete_marker", [False] * n)
+        for j in range(n):
+            yield keys[j], sizes[j] or 0, latest[j] is not False and not markers[j]
+
+def scan_inventory_file(path: str, file_format: str, columns, prefixes, suffix: str, max_samples: int, depth: int):
+    """
+    Conta un singolo file dati dell'inventory per tutti i prefissi in un'unica passata.
+    Per ogni prefisso tiene le max_samples chiavi minori, cioè quelle che il listing
+    ordinato di S3 mostrerebbe per prime. Eseguita nei processi del pool.
+    Restituisce (conteggi per prefisso, alberi per prefisso o None).
+    """
+    tallies = [[0, 0, []] for _ in prefixes]
+    trees = [PrefixTree(p, depth) for p in prefixes] if depth > 0 else None
+    for key, size, current in iter_inventory_rows(path, file_format, columns):
+        if not current or not is_file_key(key):
+            continue
+        if suffix and not key.endswith(suffix):
+            continue
+        for i, prefix in enumerate(prefixes):
+            if not key.startswith(prefix):
+                continue
+            t = tallies[i]
+            t[0] += 1
+            t[1] += size
+            if trees:
+                trees[i].add(key, size)
+            if max_samples:
+                t[2].append(key)
+                if len(t[2]) >= 2 * max_samples:
+                    t[2] = sorted(t[2])[:max_samples]
+    return [(c, b, sorted(found)[:max_samples]) for c, b, found in tallies], trees
+
+def resolve_inventory_file(key: str, data_dir: str) -> str:
+    """Trova in locale il file dati indicato nel manifest (path completo o solo nome file)."""
+    for candidate in (os.path.join(data_dir, key),
+                      os.path.join(data_dir, "data", os.path.basename(key)),
+                      os.path.join(data_dir, os.path.basename(key))):
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f"file dati non trovato in {data_dir!r}: {key}")
+
+def count_inventory(prefixes, trees):
+    """
+    Conta i prefissi leggendo i file dati dell'inventory su un pool di processi.
+    Restituisce un (oggetti, bytes, esempi) per ogni prefisso, nello stesso ordine,
+    e somma negli alberi di trees (se --depth è attivo) quelli dei singoli file.
+    """
+    data_dir = args.inventory_dir or os.path.dirname(os.path.abspath(args.inventory_manifest))
+    files = [resolve_inventory_file(f["key"], data_dir) for f in manifest.get("files", [])]
+    columns = inventory_columns(manifest.get("fileSchema", ""))
+    scan = partial(scan_inventory_file,
+                   file_format=manifest.get("fileFormat", "CSV"),
+                   columns=columns,
+                   prefixes=prefixes,
+                   suffix=args.suffix,
+                   max_samples=args.show_samples,
+                   depth=args.depth)
+
+    per_prefix = [[] for _ in prefixes]
+    workers = max(1, min(args.inventory_workers, len(files)))
+    with ProcessPoolExecutor(max_workers=workers) as procs:
+        for done, (result, file_trees) in enumerate(procs.map(scan, files), 1):
+            for i, tally in enumerate(result):
+                per_prefix[i].append(tally)
+                if file_trees:
+                    trees[i].merge(file_trees[i])
+            print(f"  ↳ inventory: {done}/{len(files)} file letti")
+
+    return [merge_tallies(tallies, args.show_samples) for tallies in per_prefix]
+
 def main():
     total_files = 0
     total_bytes = 0
@@ -57,31 +585,60 @@ def main():
     if not prefixes:
         prefixes = [""]  # prefisso vuoto = tutto il bucket
 
+    pool = ThreadPoolExecutor(max_workers=args.parallel) if args.parallel > 0 and not manifest else None
+
+    trees = [new_tree(prefix) for prefix in prefixes]
+    stop_reporter = metrics.start_reporter(args.metrics_interval) if metrics and args.metrics_interval > 0 else None
+
+    global checkpoint
     try:
-        for prefix in prefixes:
+        if args.checkpoint and not manifest:
+            checkpoint = Checkpoint(args.checkpoint, args.checkpoint_every, args.resume)
+
+        inventory = None
+        if manifest:
+            with aws_metrics.phase("inventario"):
+                inventory = count_inventory(prefixes, trees)
+
+        for i, prefix in enumerate(prefixes):
             print(f"🔎 Analizzo prefisso: {prefix!r}")
-            count = 0
-            size_sum = 0
-
-            for obj in iter_objects(args.bucket, prefix, args.max_keys):
-                key = obj["Key"]
-                if not is_file_key(key):
-                    continue
-                if args.suffix and not key.endswith(args.suffix):
-                    continue
-                total_files += 1
-                total_bytes += obj.get("Size", 0)
-                count += 1
-                size_sum += obj.get("Size", 0)
-
-                if args.show_samples and len(samples) < args.show_samples:
-                    samples.append(key)
+
+            if inventory:
+                count, size_sum, found = inventory[i]
+            elif pool:
+                count, size_sum, found = count_prefix_parallel(pool, args.bucket, prefix, trees[i])
+            else:
+                count, size_sum, found = count_listing(args.bucket, prefix, trees[i])
+
+            total_files += count
+            total_bytes += size_sum
+            samples.extend(found[: args.show_samples - len(samples)])
 
             print(f"  ↳ {count} oggetti, {size_sum} bytes")
+            if trees[i] is not None:
+                print_tree(trees[i], args.tree_top)
+
+        if args.depth > 0 and args.tree_out:
+            export_trees(trees, args.tree_out)
+            print(f"💾 Albero dei prefissi esportato in {args.tree_out}")
+        elif args.tree_out:
+            print("⚠️ --tree-out ignorato: serve anche --depth")
 
     except (BotoCoreError, ClientError) as e:
         print(f"❌ Errore AWS: {e}")
         sys.exit(1)
+    except (OSError, ValueError, IndexError) as e:
+        print(f"❌ Errore: {e}")
+        sys.exit(1)
+    finally:
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if checkpoint:
+            checkpoint.close()
+        if stop_reporter:
+            stop_reporter()
+        if metrics and args.metrics_out:
+            metrics.write(args.metrics_out)
 
     print("-" * 50)
     print(f"📊 Totale complessivo:")
@@ -92,6 +649,13 @@ def main():
         print("📋 Esempi:")
         for k in samples:
             print(f" - {k}")
+    if metrics:
+        print("-" * 50)
+        print("📈 Metriche API:")
+        for line in metrics.summary_lines():
+            print(line)
+        if args.metrics_out:
+            print(f"💾 Snapshot metriche: {args.metrics_out}")
 
 
 if __name__ == "__main__":
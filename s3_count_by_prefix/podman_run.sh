@@ -37,6 +37,10 @@ while [[ $# -gt 0 ]]; do
       echo "Esempi:"
       echo "  $0 -env prod -- --bucket my-bucket --prefix path/ --suffix .gz"
       echo "  $0 -- --bucket my-bucket --prefix data/"
+      echo "  $0 -- --bucket my-bucket --prefix data/ --parallel 32 --shard-depth 3"
+      echo "  $0 -- --inventory-manifest work/inventory/manifest.json --prefix \"data/;logs/\""
+      echo "  $0 -- --bucket my-bucket --checkpoint work/count.state.jsonl --resume"
+      echo "La cartella ./work è montata in /app/work (checkpoint, inventory, export)."
       exit 0
       ;;
     --)
@@ -90,7 +94,8 @@ IMAGE_NAME="s3-counter"
 # 4. Build immagine
 # ---------------------------------------------------
 info "Build dell'immagine '$IMAGE_NAME'..."
-podman build -t "$IMAGE_NAME" .
+# Contesto = radice del repo, per includere common/aws_clients.py
+podman build -t "$IMAGE_NAME" -f Dockerfile ..
 info "Build completata."
 
 # ---------------------------------------------------
@@ -100,10 +105,14 @@ if [ $# -eq 0 ]; then
   info "Nessun argomento passato al container. Il container userà le variabili .env."
 fi
 
+# Cartella di lavoro persistente: sopravvive al riavvio del container
+mkdir -p work
+
 info "Avvio del container '$IMAGE_NAME'..."
 # Nota: si assume che il Dockerfile imposti l'ENTRYPOINT sullo script Python (es. count_s3.py)
 if ! podman run --rm -it \
     --env-file "$TARGET_FILE" \
+    -v "$PWD/work:/app/work:Z" \
     "$IMAGE_NAME" "$@"; then
   error_exit "avvio del container fallito.
 - Verifica i parametri: $*
@@ -6,17 +6,24 @@ CONTAINER_NAME="s3-manager"
 WORKDIR="/app"
 
 echo "[INFO] build immagine ${IMAGE_NAME}"
-podman build -t "${IMAGE_NAME}" .
+# Contesto = radice del repo, per includere common/aws_clients.py
+podman build -t "${IMAGE_NAME}" -f Dockerfile ..
 
 echo "[INFO] cleanup container vecchio (se esiste)"
 if podman ps -a --format "{{.Names}}" | grep -q "^${CONTAINER_NAME}\$"; then
     podman rm -f "${CONTAINER_NAME}" >/dev/null 2>&1 || true
 fi
 
-echo "[INFO] run container interattivo"
+# Cartella condivisa per file batch, report e download
+mkdir -p work
+
+# Senza argomenti: menu interattivo. Batch non interattivo, ad esempio:
+#   ./podman_run.sh --batch work/ops.jsonl --report work/report.jsonl --concurrency 64
+echo "[INFO] run container"
 podman run \
     --name "${CONTAINER_NAME}" \
     --env-file .env \
     -it \
     --workdir "${WORKDIR}" \
-    "${IMAGE_NAME}"
+    -v "$PWD/work:${WORKDIR}/work:Z" \
+    "${IMAGE_NAME}" "$@"
@@ -1,10 +1,47 @@
 #!/usr/bin/env python3
 import os
 import sys
-import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+import json
+import asyncio
+import argparse
+import mmap
+import queue
+import time
+import zlib
+import base64
+import random
+import hashlib
+import sqlite3
+import threading
+from functools import lru_cache
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+# Factory client condivisa (common/aws_clients.py; nel container è copiata accanto allo script)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import aws_clients
+import aws_metrics
+
+# Trasferimenti di cartelle: file in parallelo sul pool condiviso
+TRANSFER_WORKERS = int(os.getenv("TRANSFER_WORKERS", "32"))
+# Per singolo file: multipart solo oltre 64 MB, poche parti in parallelo
+# perché il parallelismo principale è tra file diversi
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+PART_CONCURRENCY = 4
+PROGRESS_EVERY_SECS = 2.0
+# Download a range paralleli per oggetti grandi (download singolo file)
+RANGED_PART_SIZE = int(os.getenv("RANGED_PART_SIZE_MB", "16")) * 1024 * 1024
+RANGED_WORKERS = int(os.getenv("RANGED_WORKERS", "16"))
+RANGED_RETRIES = 5
+# Navigazione interattiva: pagine in cache per LIST_CACHE_TTL secondi
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "300"))
+LIST_PAGE_SIZE = 100
+# Indice locale del sync, salvato nella cartella sincronizzata (ed escluso dal sync)
+SYNC_INDEX_NAME = ".s3sync.db"
+DELETE_BATCH_SIZE = 1000
+
 def load_env():
     """
     Carica variabili dal file .env se presente.
@@ -14,44 +51,126 @@ def load_env():
     if not env_loaded:
         print("[INFO] .env non trovato o non caricato. Uso ambiente corrente.")
 
-def get_s3_client():
+@lru_cache(maxsize=None)
+def transfer_config():
+    """TransferConfig di boto3, creata al primo trasferimento (--help non importa boto3)."""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=MULTIPART_THRESHOLD,
+        multipart_chunksize=MULTIPART_CHUNKSIZE,
+        max_concurrency=PART_CONCURRENCY,
+        use_threads=True,
+    )
+
+def get_s3_client(max_workers=TRANSFER_WORKERS):
     """
-    Crea il client S3 usando variabili d'ambiente già caricate.
+    Crea il client S3 usando variabili d'ambiente già caricate
+    (AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY dalla catena credenziali standard).
+    Il pool di connessioni è dimensionato sui trasferimenti paralleli
+    (file in parallelo x parti per file).
     """
     try:
-        session = boto3.session.Session(
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=os.getenv("AWS_DEFAULT_REGION", "eu-west-1"),
+        return aws_clients.get_client(
+            "s3",
+            region=os.getenv("AWS_DEFAULT_REGION", "eu-west-1"),
+            max_workers=max_workers * PART_CONCURRENCY,
         )
-        return session.client("s3")
     except Exception as e:
         print(f"[ERRORE] Creazione client S3 fallita: {e}")
         sys.exit(1)
 
-def list_objects(s3, bucket, prefix=""):
+class ListingCache:
     """
-    Lista oggetti nel bucket (filtro opzionale prefix).
+    Cache delle pagine di list_objects_v2 (Delimiter='/') per prefix.
+    Le pagine vengono scaricate solo quando richieste e scadono dopo ttl
+    secondi; invalidate() scarta i prefix toccati da upload/delete della sessione.
     """
-    try:
-        paginator = s3.get_paginator("list_objects_v2")
-        pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
-
-        found = False
-        for page in pages:
-            if "Contents" in page:
-                found = True
-                for obj in page["Contents"]:
-                    size = obj["Size"]
-                    key = obj["Key"]
-                    lastmod = obj["LastModified"]
-                    print(f"{size:>10} B  {lastmod}  {key}")
-        if not found:
+
+    def __init__(self, s3, bucket, ttl=LIST_CACHE_TTL, page_size=LIST_PAGE_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.ttl = ttl
+        self.page_size = page_size
+        self.entries = {}
+
+    def page(self, prefix, number):
+        """Restituisce (cartelle, oggetti, altre_pagine, età_secondi) della pagina number."""
+        entry = self.entries.get(prefix)
+        now = time.monotonic()
+        if entry is None or now - entry["fetched"] > self.ttl:
+            entry = {"fetched": now, "pages": [], "token": None, "done": False}
+            self.entries[prefix] = entry
+        while len(entry["pages"]) <= number and not entry["done"]:
+            kwargs = {"Bucket": self.bucket, "Prefix": prefix, "Delimiter": "/", "MaxKeys": self.page_size}
+            if entry["token"]:
+                kwargs["ContinuationToken"] = entry["token"]
+            resp = self.s3.list_objects_v2(**kwargs)
+            entry["pages"].append(([cp["Prefix"] for cp in resp.get("CommonPrefixes", [])],
+                                   resp.get("Contents", [])))
+            entry["token"] = resp.get("NextContinuationToken")
+            entry["done"] = not entry["token"]
+        if number >= len(entry["pages"]):
+            return [], [], False, now - entry["fetched"]
+        folders, objects = entry["pages"][number]
+        more = number + 1 < len(entry["pages"]) or not entry["done"]
+        return folders, objects, more, now - entry["fetched"]
+
+    def invalidate(self, key):
+        """Scarta le pagine dei prefix che contengono key (o che key contiene)."""
+        for prefix in list(self.entries):
+            if key.startswith(prefix) or prefix.startswith(key):
+                del self.entries[prefix]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def browse_objects(cache, prefix=""):
+    """
+    Navigazione a pagine: mostra subito la prima pagina, le successive
+    vengono listate solo su richiesta. Le cartelle sono i CommonPrefixes.
+    """
+    number = 0
+    while True:
+        try:
+            folders, objects, more, age = cache.page(prefix, number)
+        except ClientError as e:
+            print(f"[ERRORE] list_objects: {e}")
+            return
+        except NoCredentialsError:
+            print("[ERRORE] Credenziali AWS mancanti.")
+            return
+
+        print(f"\n--- s3://{cache.bucket}/{prefix}  pagina {number + 1} (cache {age:.0f}s) ---")
+        for i, folder in enumerate(folders, 1):
+            print(f"{i:>4}) [DIR] {folder[len(prefix):]}")
+        for obj in objects:
+            print(f"{obj['Size']:>10} B  {obj['LastModified']}  {obj['Key'][len(prefix):]}")
+        if not folders and not objects:
             print("[INFO] Nessun oggetto trovato.")
-    except ClientError as e:
-        print(f"[ERRORE] list_objects: {e}")
-    except NoCredentialsError:
-        print("[ERRORE] Credenziali AWS mancanti.")
+
+        cmd = input("[numero] apri cartella, n/p pagina, .. su, r aggiorna, q esci: ").strip().lower()
+        if cmd == "q" or cmd == "":
+            return
+        if cmd == "n":
+            if more:
+                number += 1
+            else:
+                print("[INFO] Ultima pagina.")
+        elif cmd == "p":
+            number = max(number - 1, 0)
+        elif cmd == "..":
+            prefix = prefix[:prefix.rstrip("/").rfind("/") + 1]
+            number = 0
+        elif cmd == "r":
+            cache.invalidate(prefix)
+        elif cmd.isdigit() and 1 <= int(cmd) <= len(folders):
+            prefix = folders[int(cmd) - 1]
+            number = 0
+        else:
+            print("[INFO] Comando non valido.")
+
 
 def upload_file(s3, bucket, local_path, dest_key):
     """
@@ -72,12 +191,605 @@ def download_file(s3, bucket, key, local_path):
     """
     try:
         os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        head = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+        if head["ContentLength"] >= MULTIPART_THRESHOLD:
+            download_ranged(s3, bucket, key, local_path, head=head)
+            return
         s3.download_file(bucket, key, local_path)
         print(f"[OK] Download completato: s3://{bucket}/{key} -> {local_path}")
     except ClientError as e:
         print(f"[ERRORE] download_file: {e}")
     except FileNotFoundError:
         print(f"[ERRORE] Path locale non valido: {local_path}")
+    except (BotoCoreError, OSError) as e:
+        print(f"[ERRORE] download_file: {e}")
+
+
+def get_part(s3, bucket, key, etag, start, end, mm):
+    """
+    Scarica i byte [start, end] direttamente nella mappa mm alla stessa offset.
+    IfMatch garantisce che tutte le parti vengano dalla stessa versione dell'oggetto.
+    Ritenta la parte da capo su errori transitori.
+    """
+    for attempt in range(RANGED_RETRIES + 1):
+        try:
+            resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag)
+            pos = start
+            for chunk in resp["Body"].iter_chunks(1024 * 1024):
+                mm[pos:pos + len(chunk)] = chunk
+                pos += len(chunk)
+            if pos != end + 1:
+                raise OSError(f"parte {start}-{end} incompleta ({pos - start} byte)")
+            return end - start + 1
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if code in ("PreconditionFailed", "412", "NoSuchKey", "AccessDenied") or attempt == RANGED_RETRIES:
+                raise
+        except (BotoCoreError, OSError):
+            if attempt == RANGED_RETRIES:
+                raise
+        time.sleep(random.uniform(0, min(10.0, 0.2 * 2 ** attempt)))
+
+
+def verify_download(local_path, size, head, part_size=None):
+    """
+    Verifica il file scaricato con il checksum full-object (SHA256/SHA1/CRC32)
+    se presente, altrimenti con l'ETag (MD5 o multipart; non per SSE-KMS).
+    L'ETag multipart si confronta solo con part_size noto (dimensione della
+    parte 1): con una dimensione indovinata un file corretto risulterebbe diverso.
+    Restituisce (esito, metodo); esito None se non c'è nulla da verificare.
+    """
+    for field, algo in (("ChecksumSHA256", "sha256"), ("ChecksumSHA1", "sha1"), ("ChecksumCRC32", "crc32")):
+        expected = head.get(field)
+        # i checksum COMPOSITE sono per parte (checksum dei checksum), non ricalcolabili dal file
+        if not expected or head.get("ChecksumType") != "FULL_OBJECT":
+            continue
+        digest = hashlib.new(algo) if algo != "crc32" else None
+        crc = 0
+        with open(local_path, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                if digest:
+                    digest.update(block)
+                else:
+                    crc = zlib.crc32(block, crc)
+        actual = digest.digest() if digest else crc.to_bytes(4, "big")
+        return base64.b64encode(actual).decode() == expected, field
+    if head.get("ServerSideEncryption") == "aws:kms" or head.get("SSECustomerAlgorithm"):
+        return None, "ETag non è un MD5 (SSE-KMS/SSE-C)"
+    etag = head["ETag"]
+    if "-" in etag and not part_size:
+        return None, "ETag multipart con dimensione delle parti sconosciuta"
+    return local_etag(local_path, size, etag, part_size) == etag, "ETag"
+
+
+def multipart_part_size(s3, bucket, key, head):
+    """Dimensione della parte 1 di un oggetto multipart (None se single-part o non leggibile)."""
+    if "-" not in head.get("ETag", ""):
+        return None
+    try:
+        return s3.head_object(Bucket=bucket, Key=key, PartNumber=1)["ContentLength"]
+    except (ClientError, BotoCoreError):
+        return None
+
+
+def download_ranged(s3, bucket, key, local_path, part_size=RANGED_PART_SIZE,
+                    workers=RANGED_WORKERS, head=None):
+    """
+    Scarica s3://bucket/key con GET a range paralleli, scrivendo ogni parte
+    alla sua offset in un file preallocato e mappato in memoria. Il file è
+    un temporaneo nella stessa cartella, rinominato su local_path con
+    os.replace solo dopo la verifica (checksum/ETag): in caso di errore il
+    temporaneo viene rimosso e un file già presente resta intatto.
+    """
+    if head is None:
+        head = s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    size = head["ContentLength"]
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    started = time.monotonic()
+    folder, name = os.path.split(os.path.abspath(local_path))
+    tmp_path = os.path.join(folder, f".{name}.{random.getrandbits(32):08x}.part")
+    ok = False
+    try:
+        # O_EXCL: nome nuovo; permessi come open(..., "w") (0666 meno umask)
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o666)
+        with open(fd, "wb+") as f:
+            if size:
+                f.truncate(size)
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(f.fileno(), 0, size)
+                mm = mmap.mmap(f.fileno(), size)
+                try:
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        futures = [pool.submit(get_part, s3, bucket, key, head["ETag"], start, end, mm)
+                                   for start, end in ranges]
+                        for fut in futures:
+                            fut.result()
+                    mm.flush()
+                finally:
+                    mm.close()
+        if size == 0:
+            os.replace(tmp_path, local_path)
+            ok = True
+            return
+
+        verified, method = verify_download(tmp_path, size, head, multipart_part_size(s3, bucket, key, head))
+        if verified is False:
+            print(f"[ERRORE] Verifica {method} fallita per s3://{bucket}/{key}")
+            return
+        os.replace(tmp_path, local_path)
+        ok = True
+        secs = max(time.monotonic() - started, 1e-6)
+        mb = size / (1024 * 1024)
+        check = f"verificato con {method}" if verified else f"non verificato: {method}"
+        print(f"[OK] Download completato: s3://{bucket}/{key} -> {local_path} "
+              f"({mb:.1f} MB, {len(ranges)} parti, {mb / secs:.1f} MB/s, {check})")
+    finally:
+        if not ok and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class TransferStats:
+    """Contatori condivisi dai worker, con riga di avanzamento periodica."""
+
+    def __init__(self, label):
+        self.label = label
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.last_print = self.started
+        self.lock = threading.Lock()
+
+    def add(self, size=0, error=False):
+        with self.lock:
+            if error:
+                self.errors += 1
+            else:
+                self.files += 1
+                self.bytes += size
+            now = time.monotonic()
+            if now - self.last_print >= PROGRESS_EVERY_SECS:
+                self.last_print = now
+                print(f"[INFO] {self.label}: {self.summary()}")
+
+    def summary(self):
+        secs = max(time.monotonic() - self.started, 1e-6)
+        mb = self.bytes / (1024 * 1024)
+        return (f"{self.files} file, {mb:.1f} MB in {secs:.1f}s "
+                f"({self.files / secs:.1f} file/s, {mb / secs:.1f} MB/s), errori: {self.errors}")
+
+
+def run_transfers(jobs, transfer, label, workers=TRANSFER_WORKERS):
+    """
+    Esegue transfer(*job) per ogni job sul pool condiviso, con al massimo
+    2 x workers job in coda: i job vengono prodotti in streaming (walk/listing).
+    transfer restituisce i byte trasferiti.
+    """
+    stats = TransferStats(label)
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def _run(job):
+        try:
+            with aws_metrics.phase(label):
+                size = transfer(*job)
+            stats.add(size)
+        except Exception as e:
+            # upload_file solleva S3UploadFailedError (boto3), non ClientError:
+            # qualsiasi errore del singolo file va contato, non perso nel pool
+            print(f"[ERRORE] {label} {job[0]}: {e}")
+            stats.add(error=True)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for job in jobs:
+            slots.acquire()
+            pool.submit(_run, job)
+
+    print(f"[OK] {label} completato: {stats.summary()}")
+    return stats
+
+
+def upload_directory(s3, bucket, local_dir, dest_prefix, workers=TRANSFER_WORKERS):
+    """
+    Carica ricorsivamente local_dir -> s3://bucket/dest_prefix/<path relativo>
+    """
+    if not os.path.isdir(local_dir):
+        print(f"[ERRORE] Cartella locale non trovata: {local_dir}")
+        return
+    dest_prefix = dest_prefix.strip("/")
+
+    def jobs():
+        for root, _, files in os.walk(local_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, local_dir).replace(os.sep, "/")
+                yield path, f"{dest_prefix}/{rel}" if dest_prefix else rel
+
+    def _upload(path, key):
+        size = os.path.getsize(path)
+        s3.upload_file(path, bucket, key, Config=transfer_config())
+        return size
+
+    return run_transfers(jobs(), _upload, "upload", workers)
+
+
+def local_path_for(local_dir, prefix, key):
+    """Path locale per key sotto prefix; None se uscirebbe da local_dir (es. '..')."""
+    rel = key[len(prefix):].lstrip("/")
+    parts = [p for p in rel.split("/") if p]
+    if not parts or any(p in (".", "..") for p in parts):
+        return None
+    return os.path.join(local_dir, *parts)
+
+
+def download_directory(s3, bucket, prefix, local_dir, workers=TRANSFER_WORKERS):
+    """
+    Scarica ricorsivamente s3://bucket/prefix -> local_dir/<path relativo al prefix>
+    """
+    def jobs():
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if key.endswith("/"):
+                    continue  # directory marker
+                path = local_path_for(local_dir, prefix, key)
+                if path is None:
+                    print(f"[ATTENZIONE] Key saltata (path locale non valido): {key}")
+                    continue
+                yield key, path, obj["Size"]
+
+    def _download(key, path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        s3.download_file(bucket, key, path, Config=transfer_config())
+        return size
+
+    try:
+        return run_transfers(jobs(), _download, "download", workers)
+    except ClientError as e:
+        print(f"[ERRORE] download_directory: {e}")
+    except NoCredentialsError:
+        print("[ERRORE] Credenziali AWS mancanti.")
+
+def delete_keys(s3, bucket, keys, workers=4, label="delete"):
+    """
+    Cancella le chiavi con delete_objects a blocchi di DELETE_BATCH_SIZE sul pool.
+    Ogni elemento è una key oppure una coppia (key, version_id).
+    Stampa avanzamento e throughput; restituisce (cancellate, errori).
+    """
+    deleted = 0
+    errors = 0
+    started = time.monotonic()
+    last_print = started
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(workers * 2)
+
+    def _delete(batch):
+        nonlocal deleted, errors, last_print
+        objects = [{"Key": k} if isinstance(k, str) else {"Key": k[0], "VersionId": k[1]} for k in batch]
+        try:
+            with aws_metrics.phase(label):
+                resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+            failed = resp.get("Errors", [])
+        except (ClientError, BotoCoreError) as e:
+            print(f"[ERRORE] delete_objects: {e}")
+            failed = objects
+        finally:
+            slots.release()
+        for err in failed:
+            if err.get("Code"):
+                print(f"[ERRORE] delete {err['Key']}: {err['Code']} {err.get('Message', '')}")
+        with lock:
+            deleted += len(batch) - len(failed)
+            errors += len(failed)
+            now = time.monotonic()
+            if now - last_print >= PROGRESS_EVERY_SECS:
+                last_print = now
+                print(f"[INFO] {label}: {deleted} oggetti cancellati "
+                      f"({deleted / (now - started):.0f} obj/s), errori: {errors}")
+
+    def _submit(pool, batch):
+        slots.acquire()
+        pool.submit(_delete, batch)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) == DELETE_BATCH_SIZE:
+                _submit(pool, batch)
+                batch = []
+        if batch:
+            _submit(pool, batch)
+
+    secs = max(time.monotonic() - started, 1e-6)
+    print(f"[OK] {label} completato: {deleted} oggetti in {secs:.1f}s "
+          f"({deleted / secs:.0f} obj/s), errori: {errors}")
+    return deleted, errors
+
+
+def iter_prefix_sharded(s3, bucket, prefix, all_versions=False, workers=8):
+    """
+    Lista prefix in parallelo: un primo livello con Delimiter='/' fornisce gli
+    shard (sotto-prefix), listati poi da thread distinti. Restituisce in
+    streaming le key (o coppie (key, version_id) con all_versions) e la size.
+    """
+    op = "list_object_versions" if all_versions else "list_objects_v2"
+    paginator = s3.get_paginator(op)
+
+    def _items(page):
+        if all_versions:
+            for v in page.get("Versions", []):
+                yield (v["Key"], v["VersionId"]), v.get("Size", 0)
+            for m in page.get("DeleteMarkers", []):
+                yield (m["Key"], m["VersionId"]), 0
+        else:
+            for obj in page.get("Contents", []):
+                yield obj["Key"], obj["Size"]
+
+    shards = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        shards.extend(cp["Prefix"] for cp in page.get("CommonPrefixes", []))
+        yield from _items(page)
+    if not shards:
+        return
+
+    results = queue.Queue(maxsize=DELETE_BATCH_SIZE * workers)
+    done = object()
+    # Impostato quando il consumatore smette (break, eccezione, Ctrl-C):
+    # i thread non devono restare bloccati su una coda piena
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _list(shard):
+        try:
+            for page in paginator.paginate(Bucket=bucket, Prefix=shard):
+                for item in _items(page):
+                    if not _put(item):
+                        return
+        except (ClientError, BotoCoreError) as e:
+            _put(e)
+        finally:
+            _put(done)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for shard in shards:
+            pool.submit(_list, shard)
+        pending = len(shards)
+        while pending:
+            item = results.get()
+            if item is done:
+                pending -= 1
+            elif isinstance(item, Exception):
+                print(f"[ERRORE] {op}: {item}")
+            else:
+                yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        # libera i thread fermi su put() prima del prossimo controllo di stop
+        while True:
+            try:
+                results.get_nowait()
+            except queue.Empty:
+                break
+
+
+def delete_prefix(s3, bucket, prefix, all_versions=False, dry_run=False, workers=8):
+    """
+    Cancella tutti gli oggetti sotto s3://bucket/prefix (listing a shard paralleli,
+    delete_objects a blocchi da 1000). all_versions=True rimuove anche tutte le
+    versioni e i delete marker dei bucket versionati.
+    dry_run=True conta soltanto e mostra un campione delle key.
+    """
+    try:
+        items = iter_prefix_sharded(s3, bucket, prefix, all_versions, workers)
+        if dry_run:
+            count = 0
+            size = 0
+            for key, obj_size in items:
+                if count < 20:
+                    print(f"[DRY RUN] DELETE s3://{bucket}/{key if isinstance(key, str) else f'{key[0]} (versione {key[1]})'}")
+                count += 1
+                size += obj_size
+            what = "versioni/delete marker" if all_versions else "oggetti"
+            print(f"[DRY RUN] {count} {what} da cancellare, {size / (1024 * 1024):.1f} MB")
+            return count
+        deleted, _ = delete_keys(s3, bucket, (key for key, _ in items), workers, "delete prefix")
+        return deleted
+    except ClientError as e:
+        print(f"[ERRORE] delete_prefix: {e}")
+    except NoCredentialsError:
+        print("[ERRORE] Credenziali AWS mancanti.")
+
+
+class SyncIndex:
+    """
+    Indice SQLite dei file già sincronizzati: per ogni path relativo
+    dimensione e mtime locali al momento dell'upload ed ETag remoto risultante.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "rel TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, etag TEXT)")
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def load(self):
+        with self.lock:
+            return {rel: (size, mtime_ns, etag)
+                    for rel, size, mtime_ns, etag in self.db.execute("SELECT rel, size, mtime_ns, etag FROM files")}
+
+    def put(self, rel, size, mtime_ns, etag):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (rel, size, mtime_ns, etag))
+            self.pending += 1
+            if self.pending >= 500:
+                self.db.commit()
+                self.pending = 0
+
+    def remove(self, rels):
+        with self.lock:
+            self.db.executemany("DELETE FROM files WHERE rel = ?", ((r,) for r in rels))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def local_etag(path, size, remote_etag=None, part_size=None):
+    """
+    ETag che S3 calcolerebbe per il file: MD5 per upload singolo, oppure
+    MD5 degli MD5 delle parti + '-N' per i multipart. Con part_size la
+    dimensione di parte è quella indicata; altrimenti, se l'ETag remoto indica
+    N parti, viene stimata (MULTIPART_CHUNKSIZE o MiB interi): la stima può
+    sbagliare, quindi un ETag diverso non prova che il file sia diverso.
+    """
+    parts = 0
+    chunk = part_size or MULTIPART_CHUNKSIZE
+    if remote_etag and "-" in remote_etag:
+        parts = int(remote_etag.strip('"').rsplit("-", 1)[1])
+        if not part_size and -(-size // chunk) != parts:
+            mib = 1024 * 1024
+            chunk = -(-size // parts)
+            chunk = -(-chunk // mib) * mib
+    elif remote_etag is None and size >= MULTIPART_THRESHOLD:
+        parts = -(-size // chunk)
+
+    with open(path, "rb") as f:
+        if not parts:
+            md5 = hashlib.md5()
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+            return f'"{md5.hexdigest()}"'
+        digests = []
+        for block in iter(lambda: f.read(chunk), b""):
+            digests.append(hashlib.md5(block).digest())
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}"'
+
+
+class SyncPlan:
+    """Esito del confronto di sync_directory: file da caricare e chiavi remote senza file locale."""
+
+    def __init__(self, base, changed, extraneous, delete):
+        self.base = base                # prefix remoto con '/' finale (o vuoto)
+        self.changed = changed          # [(path, rel, size, mtime_ns), ...]
+        self.extraneous = extraneous    # [rel, ...]
+        self.delete = delete
+
+    def __bool__(self):
+        return bool(self.changed or (self.delete and self.extraneous))
+
+
+def plan_sync(s3, bucket, local_dir, base, delete, trust_index, index):
+    """Lista il prefix (se non trust_index) e percorre local_dir una sola volta."""
+    known = index.load()
+
+    remote = None
+    if not trust_index:
+        remote = {}
+        try:
+            paginator = s3.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket, Prefix=base):
+                for obj in page.get("Contents", []):
+                    remote[obj["Key"][len(base):]] = (obj["Size"], obj["ETag"])
+        except ClientError as e:
+            print(f"[ERRORE] sync list_objects: {e}")
+            return None
+
+    local = set()
+    changed = []
+    for root, _, files in os.walk(local_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, local_dir).replace(os.sep, "/")
+            if rel == SYNC_INDEX_NAME:
+                continue
+            local.add(rel)
+            st = os.stat(path)
+            saved = known.get(rel)
+            if saved and saved[:2] == (st.st_size, st.st_mtime_ns):
+                if remote is None:
+                    continue
+                size_etag = remote.get(rel)
+                if size_etag and size_etag == (saved[0], saved[2]):
+                    continue
+            elif remote is not None and rel in remote and remote[rel][0] == st.st_size:
+                # non indicizzato o modificato: stesso contenuto già presente?
+                etag = remote[rel][1]
+                if local_etag(path, st.st_size, etag) == etag:
+                    index.put(rel, st.st_size, st.st_mtime_ns, etag)
+                    continue
+            changed.append((path, rel, st.st_size, st.st_mtime_ns))
+
+    if remote is not None:
+        extraneous = sorted(rel for rel in remote if rel not in local)
+    else:
+        extraneous = sorted(rel for rel in known if rel not in local)
+
+    print(f"[INFO] Sync: {len(local)} file locali, {len(changed)} da caricare, "
+          f"{len(extraneous)} remoti senza file locale{' (verranno cancellati)' if delete else ''}")
+    return SyncPlan(base, changed, extraneous, delete)
+
+
+def sync_directory(s3, bucket, local_dir, prefix, delete=False, trust_index=False,
+                   dry_run=False, workers=TRANSFER_WORKERS, plan=None):
+    """
+    Sync incrementale local_dir -> s3://bucket/prefix.
+    Un file è invariato se size e mtime coincidono con l'indice locale e l'ETag
+    remoto è quello registrato all'ultimo upload; i file non indicizzati vengono
+    confrontati per ETag (anche multipart) prima di caricarli.
+    trust_index=True non lista il bucket: decide solo su indice e file locali.
+    delete=True cancella (a blocchi) le chiavi remote senza file locale.
+    Restituisce il SyncPlan (None in caso di errore); passando plan= si esegue
+    un piano già calcolato, es. da un dry_run confermato, senza rilistare.
+    """
+    if not os.path.isdir(local_dir):
+        print(f"[ERRORE] Cartella locale non trovata: {local_dir}")
+        return None
+    index = SyncIndex(os.path.join(local_dir, SYNC_INDEX_NAME))
+    try:
+        if plan is None:
+            prefix = prefix.strip("/")
+            with aws_metrics.phase("sync piano"):
+                plan = plan_sync(s3, bucket, local_dir, f"{prefix}/" if prefix else "", delete, trust_index, index)
+            if plan is None:
+                return None
+        base = plan.base
+
+        if dry_run:
+            for _, rel, _, _ in plan.changed:
+                print(f"[DRY RUN] UPLOAD {rel} -> s3://{bucket}/{base}{rel}")
+            if plan.delete:
+                for rel in plan.extraneous:
+                    print(f"[DRY RUN] DELETE s3://{bucket}/{base}{rel}")
+            return plan
+
+        def _upload(path, rel, size, mtime_ns):
+            s3.upload_file(path, bucket, base + rel, Config=transfer_config())
+            etag = s3.head_object(Bucket=bucket, Key=base + rel)["ETag"]
+            index.put(rel, size, mtime_ns, etag)
+            return size
+
+        if plan.changed:
+            run_transfers(plan.changed, _upload, "sync", workers)
+        if plan.delete and plan.extraneous:
+            delete_keys(s3, bucket, (base + rel for rel in plan.extraneous), label="sync delete")
+            index.remove(plan.extraneous)
+        return plan
+    finally:
+        index.close()
 
 def delete_object(s3, bucket, key):
     """
@@ -89,13 +801,104 @@ def delete_object(s3, bucket, key):
     except ClientError as e:
         print(f"[ERRORE] delete_object: {e}")
 
+def batch_operation(s3, default_bucket, op):
+    """
+    Esegue una riga del file batch (dict JSON) e restituisce i campi del report.
+    Solleva eccezione in caso di errore.
+    """
+    kind = op.get("op")
+    with aws_metrics.phase(f"batch {kind}"):
+        return _batch_operation(s3, op.get("bucket", default_bucket), kind, op)
+
+
+def _batch_operation(s3, bucket, kind, op):
+    if kind == "list":
+        count = 0
+        size = 0
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=op.get("prefix", "")):
+            for obj in page.get("Contents", []):
+                count += 1
+                size += obj["Size"]
+        return {"count": count, "bytes": size}
+    if kind == "upload":
+        size = os.path.getsize(op["src"])
+        s3.upload_file(op["src"], bucket, op["key"], Config=transfer_config())
+        return {"bytes": size}
+    if kind == "download":
+        os.makedirs(os.path.dirname(op["dest"]) or ".", exist_ok=True)
+        s3.download_file(bucket, op["key"], op["dest"], Config=transfer_config())
+        return {"bytes": os.path.getsize(op["dest"])}
+    if kind == "delete":
+        s3.delete_object(Bucket=bucket, Key=op["key"])
+        return {}
+    raise ValueError(f"operazione non supportata: {kind!r}")
+
+
+async def run_batch(s3, bucket, ops_path, report_path, concurrency=TRANSFER_WORKERS):
+    """
+    Esegue le operazioni di ops_path (JSONL: list/upload/download/delete) in un
+    solo processo: event loop asyncio, al massimo concurrency operazioni in
+    corso sul pool di thread e sul client condivisi. Ogni esito viene scritto
+    su report_path (JSONL) appena completato. Restituisce il numero di errori.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    totals = {"ok": 0, "error": 0}
+    started = time.monotonic()
+
+    async def _run(line_no, line, report):
+        t0 = time.monotonic()
+        result = {"line": line_no}
+        try:
+            op = json.loads(line)
+            if not isinstance(op, dict):
+                raise ValueError("ogni riga deve essere un oggetto JSON")
+            result.update({k: op[k] for k in ("id", "op", "key", "prefix") if k in op})
+            result.update(await loop.run_in_executor(pool, batch_operation, s3, bucket, op))
+            result["status"] = "ok"
+        except Exception as e:
+            # ogni riga deve avere il suo esito nel report, anche per errori
+            # fuori da botocore (es. S3UploadFailedError di upload_file)
+            result.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            slots.release()
+        result["elapsed_ms"] = round((time.monotonic() - t0) * 1000, 1)
+        totals[result["status"]] += 1
+        report.write(json.dumps(result) + "\n")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, \
+            open(ops_path, encoding="utf-8") as ops, \
+            open(report_path, "w", encoding="utf-8") as report:
+        for line_no, line in enumerate(ops, 1):
+            if not line.strip():
+                continue
+            await slots.acquire()
+            task = asyncio.create_task(_run(line_no, line, report))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    secs = max(time.monotonic() - started, 1e-6)
+    done = totals["ok"] + totals["error"]
+    print(f"[OK] Batch completato: {done} operazioni in {secs:.1f}s ({done / secs:.1f} op/s), "
+          f"ok: {totals['ok']}, errori: {totals['error']} -> {report_path}")
+    return totals["error"]
+
+
 def print_menu():
     print("\n=== S3 Manager ===")
-    print("1) Lista oggetti")
+    print("1) Lista oggetti (navigazione a pagine, in cache)")
     print("2) Upload file")
     print("3) Download file")
     print("4) Elimina oggetto")
     print("5) Esci")
+    print("6) Upload cartella (ricorsivo, parallelo)")
+    print("7) Download cartella (ricorsivo, parallelo)")
+    print("8) Sync cartella -> prefix (solo file modificati)")
+    print("9) Elimina prefix (tutti gli oggetti sotto il prefix)")
 
 def main():
     load_env()
@@ -106,6 +909,7 @@ def main():
         bucket = input("Bucket S3 da usare: ").strip()
 
     s3 = get_s3_client()
+    cache = ListingCache(s3, bucket)
 
     while True:
         print_menu()
@@ -113,12 +917,13 @@ def main():
 
         if choice == "1":
             prefix = input("Prefix (ENTER per tutto): ").strip()
-            list_objects(s3, bucket, prefix)
+            browse_objects(cache, prefix)
 
         elif choice == "2":
             local_path = input("Percorso file locale (host non container se bind-mountato): ").strip()
             dest_key = input("Key S3 di destinazione (es cartella/file.ext): ").strip()
             upload_file(s3, bucket, local_path, dest_key)
+            cache.invalidate(dest_key)
 
         elif choice == "3":
             key = input("Key S3 da scaricare: ").strip()
@@ -130,6 +935,7 @@ def main():
             conferma = input(f"Confermi eliminazione di s3://{bucket}/{key}? (yes/no): ").strip().lower()
             if conferma == "yes":
                 delete_object(s3, bucket, key)
+                cache.invalidate(key)
             else:
                 print("[INFO] Eliminazione annullata.")
 
@@ -137,8 +943,98 @@ def main():
             print("Uscita.")
             break
 
+        elif choice == "6":
+            local_dir = input("Cartella locale da caricare: ").strip()
+            dest_prefix = input("Prefix S3 di destinazione (ENTER per radice bucket): ").strip()
+            upload_directory(s3, bucket, local_dir, dest_prefix)
+            cache.invalidate(dest_prefix.strip("/"))
+
+        elif choice == "7":
+            prefix = input("Prefix S3 da scaricare: ").strip()
+            local_dir = input("Cartella locale di destinazione (nel container): ").strip()
+            download_directory(s3, bucket, prefix, local_dir)
+
+        elif choice == "8":
+            local_dir = input("Cartella locale da sincronizzare: ").strip()
+            prefix = input("Prefix S3 di destinazione (ENTER per radice bucket): ").strip()
+            trust = input("Fidarsi dell'indice locale senza listare il bucket? (yes/no): ").strip().lower() == "yes"
+            delete = input("Cancellare gli oggetti remoti senza file locale? (yes/no): ").strip().lower() == "yes"
+            plan = sync_directory(s3, bucket, local_dir, prefix, delete=delete, trust_index=trust, dry_run=True)
+            if plan is None:
+                continue
+            if not plan:
+                print("[INFO] Niente da sincronizzare.")
+                continue
+            if input("Procedo con il sync? (yes/no): ").strip().lower() == "yes":
+                # stesso piano mostrato sopra: niente secondo listing né seconda scansione
+                sync_directory(s3, bucket, local_dir, prefix, plan=plan)
+                cache.invalidate(prefix.strip("/"))
+            else:
+                print("[INFO] Sync annullato.")
+
+        elif choice == "9":
+            prefix = input("Prefix S3 da svuotare: ").strip()
+            versions = input("Eliminare anche tutte le versioni (bucket versionato)? (yes/no): ").strip().lower() == "yes"
+            count = delete_prefix(s3, bucket, prefix, all_versions=versions, dry_run=True)
+            if not count:
+                print("[INFO] Nessun oggetto da eliminare.")
+                continue
+            target = prefix or bucket
+            conferma = input(f"Per confermare digita '{target}': ").strip()
+            if conferma == target:
+                delete_prefix(s3, bucket, prefix, all_versions=versions)
+                cache.invalidate(prefix)
+            else:
+                print("[INFO] Eliminazione annullata.")
+
         else:
             print("[INFO] Scelta non valida.")
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="S3 Manager: menu interattivo oppure esecuzione batch non interattiva",
+    )
+    parser.add_argument("--batch", help="File JSONL di operazioni, es. "
+                        '{"op": "upload", "src": "a.txt", "key": "dir/a.txt"} '
+                        "(op: list/upload/download/delete, bucket opzionale; "
+                        "le righe sono indipendenti ed eseguite in parallelo)")
+    parser.add_argument("--report", default="batch_report.jsonl", help="File JSONL con l'esito di ogni operazione")
+    parser.add_argument("--concurrency", type=int, default=TRANSFER_WORKERS, help="Operazioni batch in parallelo")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="Solo --batch: secondi tra due righe di avanzamento con le metriche delle API (0 = nessuna)")
+    parser.add_argument("--metrics-out", default="",
+                        help="Snapshot finale delle metriche all'uscita: JSON o testo Prometheus (in base all'estensione)")
+    return parser.parse_args()
+
+def print_metrics(metrics, path):
+    print("[INFO] Metriche API:")
+    for line in metrics.summary_lines():
+        print(line)
+    if path:
+        metrics.write(path)
+        print(f"[INFO] Snapshot metriche: {path}")
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    # prima di creare i client: gli hook vengono agganciati da aws_clients
+    metrics = aws_metrics.enable() if args.metrics_interval > 0 or args.metrics_out else None
+    errors = 0
+    try:
+        if args.batch:
+            load_env()
+            bucket = os.getenv("AWS_S3_BUCKET")
+            s3 = get_s3_client(args.concurrency)
+            # nel menu interattivo le righe periodiche si mescolerebbero ai prompt
+            stop_reporter = (metrics.start_reporter(args.metrics_interval)
+                             if metrics and args.metrics_interval > 0 else None)
+            try:
+                errors = asyncio.run(run_batch(s3, bucket, args.batch, args.report, args.concurrency))
+            finally:
+                if stop_reporter:
+                    stop_reporter()
+        else:
+            main()
+    finally:
+        if metrics:
+            print_metrics(metrics, args.metrics_out)
+    sys.exit(1 if errors else 0)